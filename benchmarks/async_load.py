@@ -0,0 +1,108 @@
+"""
+Concurrent throughput of the sync (gunicorn + Flask) and async (uvicorn +
+asgi.py) deployments against the same database.
+
+The response cache is turned off so every request reaches the database. Pass
+--database-url with a throwaway Postgres database (and --i-know, since it is
+dropped and reseeded) to see the effect of real network round trips; the
+default scratch SQLite file mostly measures CPU.
+
+    $ pipenv run python benchmarks/async_load.py --workers 2 --concurrency 64
+"""
+import argparse
+import http.client
+import os
+import random
+import subprocess
+import threading
+import time
+from common import ROOT, SRC, configure, add_seed_arguments, seed, percentiles, report
+
+SERVERS = {
+    "sync": ["gunicorn", "wsgi", "--chdir", SRC, "--workers", "{workers}", "--bind", "127.0.0.1:{port}"],
+    "async": ["uvicorn", "asgi:app", "--app-dir", SRC, "--workers", "{workers}", "--port", "{port}", "--log-level", "warning"],
+}
+
+
+def wait_until_ready(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/characters/1")
+            connection.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("server on port %d did not start" % port)
+
+
+def run_load(port, paths, concurrency, duration):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    stop_at = time.time() + duration
+
+    def client():
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        local = []
+        while time.time() < stop_at:
+            path = random.choice(paths)
+            start = time.perf_counter()
+            try:
+                connection.request("GET", path)
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    errors[0] += 1
+            except (OSError, http.client.HTTPException):
+                errors[0] += 1
+                connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+                continue
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return dict(percentiles(latencies),
+                requests=len(latencies),
+                errors=errors[0],
+                rps=round(len(latencies) / duration, 1))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_seed_arguments(parser)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--port", type=int, default=3100)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    configure(args.database_url)
+    seed(args)
+    paths = (["/characters?limit=50&after=%d" % (i * 50) for i in range(args.characters // 50)]
+             + ["/characters/%d" % i for i in range(1, args.characters + 1, 7)]
+             + ["/user/%d/favorites" % i for i in range(1, args.users + 1)])
+
+    results = {}
+    for mode, command in SERVERS.items():
+        command = [x.format(workers=args.workers, port=args.port) for x in command]
+        # configure() set DATABASE_URL, so the servers use the database seed() filled
+        server = subprocess.Popen(command, cwd=ROOT, env=dict(os.environ))
+        try:
+            wait_until_ready(args.port)
+            results[mode] = run_load(args.port, paths, args.concurrency, args.duration)
+        finally:
+            server.terminate()
+            server.wait()
+    report("async_load", vars(args), results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Shared pieces of the benchmark scripts: database seeding, query counting and
+the JSON report format.
+"""
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from sqlalchemy.engine import make_url
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SRC = os.path.join(ROOT, "src")
+sys.path.insert(0, SRC)
+SCRATCH_DATABASE_URL = "sqlite:///" + os.path.join(tempfile.gettempdir(), "benchmark.db")
+
+
+def configure(database_url=None, cache=False):
+    # Must run before `app` is imported: the app reads its config at import time.
+    # DATABASE_URL is always overwritten, never inherited: pipenv loads .env,
+    # which points at the developer's own database.
+    os.environ["DATABASE_URL"] = database_url or SCRATCH_DATABASE_URL
+    if not cache:
+        os.environ["RESPONSE_CACHE_MAX_ENTRIES"] = "0"
+
+
+def is_scratch_database(database_url):
+    # In-memory SQLite or a SQLite file in the temp directory
+    url = make_url(database_url)
+    if url.get_backend_name() != "sqlite":
+        return False
+    if url.database in (None, "", ":memory:"):
+        return True
+    return os.path.abspath(url.database).startswith(tempfile.gettempdir() + os.sep)
+
+
+def add_seed_arguments(parser):
+    parser.add_argument("--database-url", default=None, help="defaults to " + SCRATCH_DATABASE_URL)
+    parser.add_argument("--i-know", action="store_true",
+                        help="allow dropping and reseeding a database that is not a scratch SQLite file")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--characters", type=int, default=5000)
+    parser.add_argument("--episodes", type=int, default=500)
+    parser.add_argument("--locations", type=int, default=500)
+    parser.add_argument("--favorites", type=int, default=20, help="favorites of each kind per user")
+    parser.add_argument("--seed", type=int, default=42)
+
+
+def seed(args):
+    database_url = os.environ["DATABASE_URL"]
+    if not is_scratch_database(database_url) and not args.i_know:
+        sys.exit("Refusing to drop every table in %s; pass --i-know if that is intended"
+                 % make_url(database_url).render_as_string(hide_password=True))
+    from app import app
+    from models import db, User, Character, Episode, Location, character_favs, location_favs, episode_favs
+    random.seed(args.seed)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.execute(User.__table__.insert(), [
+            {"id": i, "username": "user%d" % i, "first_name": "First", "last_name": "Last",
+             "email": "user%d@example.com" % i, "password": "secret", "is_active": True}
+            for i in range(1, args.users + 1)
+        ])
+        db.session.execute(Character.__table__.insert(), [
+            {"id": i, "character_name": "Character %d" % i, "gender": random.choice(["Female", "Male", "unknown"]),
+             "alive": random.random() < 0.7, "species": random.choice(["Human", "Alien", "Robot", "Cronenberg"])}
+            for i in range(1, args.characters + 1)
+        ])
+        db.session.execute(Episode.__table__.insert(), [
+            {"id": i, "episode_name": "Episode %d" % i, "air_date": "2013-12-02", "episode": "S%02dE%03d" % (i // 100, i)}
+            for i in range(1, args.episodes + 1)
+        ])
+        db.session.execute(Location.__table__.insert(), [
+            {"id": i, "location_name": "Location %d" % i, "location_type": random.choice(["Planet", "Space station"]),
+             "dimension": "C-%d" % (i % 50)}
+            for i in range(1, args.locations + 1)
+        ])
+        for table, column, total in ((character_favs, "character_id", args.characters),
+                                     (location_favs, "location_id", args.locations),
+                                     (episode_favs, "episode_id", args.episodes)):
+            rows = [{"user_id": u, column: x}
+                    for u in range(1, args.users + 1)
+                    for x in random.sample(range(1, total + 1), min(args.favorites, total))]
+            if rows:
+                db.session.execute(table.insert(), rows)
+        db.session.commit()
+    return app
+
+
+class QueryCounter:
+    # Counts statements sent to the database by the engine it is installed on.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def install(self, engine):
+        from sqlalchemy import event
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        with self._lock:
+            self.count += 1
+
+    def take(self):
+        with self._lock:
+            count, self.count = self.count, 0
+        return count
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    if not samples:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None}
+
+    def pick(p):
+        return round(samples[min(len(samples) - 1, int(len(samples) * p))] * 1000, 3)
+
+    return {"p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99)}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(name, settings, results, output=None):
+    document = {
+        "benchmark": name,
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "settings": settings,
+        "results": results,
+    }
+    text = json.dumps(document, indent=2, sort_keys=True)
+    if output:
+        with open(output, "w") as file:
+            file.write(text + "\n")
+    print(text)
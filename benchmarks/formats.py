@@ -0,0 +1,61 @@
+"""
+Encode cost and payload size of the full catalog (every character, episode
+and location, as the list endpoints serialize them) in JSON and MessagePack.
+Decode cost is included since the consumers pay it on every poll.
+
+    $ pipenv run python benchmarks/formats.py --characters 100000 --output formats.json
+"""
+import argparse
+import json
+import time
+import msgpack
+from common import configure, add_seed_arguments, seed, report
+
+
+def best_of(repeat, fn):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return round(min(timings) * 1000, 3), result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_seed_arguments(parser)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    configure(args.database_url)
+    app = seed(args)
+    import serialization
+    from models import Character, Episode, Location
+    from utils import select_fields
+
+    with app.app_context():
+        catalog = {}
+        for model in (Character, Episode, Location):
+            query, serialize = select_fields(model, sparse=False)
+            catalog[model.__tablename__] = {"body": [serialize(x) for x in query.order_by(model.id).all()]}
+
+    encoders = {"json-" + name: backend for name, backend in serialization.BACKENDS.items()}
+    encoders["msgpack"] = msgpack.packb
+    decoders = {"json": json.loads, "msgpack": msgpack.unpackb}
+
+    results = {}
+    for name, encode in encoders.items():
+        encode_ms, payloads = best_of(args.repeat, lambda: [encode(x) for x in catalog.values()])
+        decode = decoders[name.split("-")[0]]
+        decode_ms, _ = best_of(args.repeat, lambda: [decode(x) for x in payloads])
+        results[name] = {
+            "encode_ms": encode_ms,
+            "decode_ms": decode_ms,
+            "bytes": sum(len(x) for x in payloads),
+        }
+    report("formats", vars(args), results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Micro-benchmarks for every handler in src/app.py (through the Flask test
+client, so no network) and for each model's serialize() method.
+
+Write handlers get an untimed setup/cleanup request around each timed call so
+the database ends every iteration in the state it started in.
+
+    $ pipenv run python benchmarks/handlers.py --iterations 200 --output handlers.json
+"""
+import argparse
+import time
+from common import configure, add_seed_arguments, seed, QueryCounter, percentiles, report
+
+
+def build_scenarios(app, args):
+    users = args.users
+    bench_user = users + 1
+    # A character/location/episode id none of the seeded favorites use for the bench user
+    spare = 1
+
+    def user(i):
+        return i % users + 1
+
+    def register(i, prefix="bench"):
+        return ("POST", "/user_register", {"username": "%s%d" % (prefix, i), "first_name": "B", "last_name": "B",
+                                           "email": "%s%d@example.com" % (prefix, i), "password": "x"})
+
+    def delete_registered(i):
+        # The register endpoint does not return the id; look it up (untimed)
+        from models import User
+        with app.app_context():
+            user_id = User.query.filter_by(email="delete%d@example.com" % i).one().id
+        return ("DELETE", "/user/%d" % user_id, None)
+
+    def favorite(kind, method):
+        def request(i):
+            return (method, "/user/%d/favorites/%ss/%d" % (bench_user, kind, spare), {kind + "_id": spare})
+        return request
+
+    return [
+        # name, setup, timed request, cleanup
+        ("sitemap", None, lambda i: ("GET", "/", None), None),
+        ("get_all_users", None, lambda i: ("GET", "/users", None), None),
+        ("get_all_characters", None, lambda i: ("GET", "/characters?after=%d" % (i * 50 % args.characters), None), None),
+        ("get_character_by_id", None, lambda i: ("GET", "/characters/%d" % (i % args.characters + 1), None), None),
+        ("get_all_episodes", None, lambda i: ("GET", "/episodes", None), None),
+        ("get_episode_by_id", None, lambda i: ("GET", "/episodes/%d" % (i % args.episodes + 1), None), None),
+        ("get_all_locations", None, lambda i: ("GET", "/locations", None), None),
+        ("get_location_by_id", None, lambda i: ("GET", "/locations/%d" % (i % args.locations + 1), None), None),
+        ("get_episode_characters", None, lambda i: ("GET", "/episodes/%d/characters" % (i % args.episodes + 1), None), None),
+        ("get_character_episodes", None, lambda i: ("GET", "/characters/%d/episodes" % (i % args.characters + 1), None), None),
+        ("get_location_residents", None, lambda i: ("GET", "/locations/%d/residents" % (i % args.locations + 1), None), None),
+        ("get_top_characters", None, lambda i: ("GET", "/characters/top", None), None),
+        ("get_top_episodes", None, lambda i: ("GET", "/episodes/top", None), None),
+        ("get_top_locations", None, lambda i: ("GET", "/locations/top", None), None),
+        ("search_catalog", None, lambda i: ("GET", "/search?q=charactr %d" % i, None), None),
+        ("get_all_user_favorites", None, lambda i: ("GET", "/user/%d/favorites" % user(i), None), None),
+        ("get_character_user_favorites", None, lambda i: ("GET", "/user/%d/favorites/character" % user(i), None), None),
+        ("get_location_user_favorites", None, lambda i: ("GET", "/user/%d/favorites/location" % user(i), None), None),
+        ("get_episode_user_favorites", None, lambda i: ("GET", "/user/%d/favorites/episode" % user(i), None), None),
+        ("add_character_favorite", None, favorite("character", "POST"), favorite("character", "DELETE")),
+        ("remove_character_favorite", favorite("character", "POST"), favorite("character", "DELETE"), None),
+        ("add_location_favorite", None, favorite("location", "POST"), favorite("location", "DELETE")),
+        ("remove_location_favorite", favorite("location", "POST"), favorite("location", "DELETE"), None),
+        ("add_episode_favorite", None, favorite("episode", "POST"), favorite("episode", "DELETE")),
+        ("remove_episode_favorite", favorite("episode", "POST"), favorite("episode", "DELETE"), None),
+        ("update_user_favorites", None,
+         lambda i: ("PATCH", "/user/%d/favorites" % bench_user, {"add": {"characters": [1, 2, 3], "episodes": [1]}}),
+         lambda i: ("PATCH", "/user/%d/favorites" % bench_user, {"remove": {"characters": [1, 2, 3], "episodes": [1]}})),
+        ("user_register", None, register, None),
+        ("delete_user_by_id", lambda i: register(i, "delete"), delete_registered, None),
+        ("pool_status", None, lambda i: ("GET", "/stats/pool", None), None),
+    ]
+
+
+def send(client, request):
+    method, path, body = request
+    return client.open(path, method=method, json=body)
+
+
+def bench_handlers(app, args, counter):
+    from models import db, User
+    client = app.test_client()
+    with app.app_context():
+        db.session.add(User(id=args.users + 1, username="bench", first_name="B", last_name="B",
+                            email="bench@example.com", password="x"))
+        db.session.commit()
+    results = {}
+    for name, setup, request, cleanup in build_scenarios(app, args):
+        if args.only and name not in args.only:
+            continue
+        timings, queries, statuses = [], [], set()
+        for i in range(args.iterations):
+            if setup:
+                send(client, setup(i))
+            timed = request(i)
+            counter.take()
+            start = time.perf_counter()
+            response = send(client, timed)
+            timings.append(time.perf_counter() - start)
+            queries.append(counter.take())
+            statuses.add(response.status_code)
+            if cleanup:
+                send(client, cleanup(i))
+        results[name] = dict(percentiles(timings),
+                             mean_ms=round(sum(timings) / len(timings) * 1000, 3),
+                             queries_per_request=round(sum(queries) / len(queries), 2),
+                             statuses=sorted(statuses))
+    return results
+
+
+def bench_serialize(app, args):
+    from models import db, User, Character, Episode, Location
+    from utils import select_fields
+    results = {}
+    with app.app_context():
+        for model in (User, Character, Episode, Location):
+            instances = model.query.order_by(model.id).limit(args.serialize_rows).all()
+            start = time.perf_counter()
+            for instance in instances:
+                instance.serialize()
+            orm = time.perf_counter() - start
+            query, serialize = select_fields(model, sparse=False)
+            rows = query.order_by(model.id).limit(args.serialize_rows).all()
+            start = time.perf_counter()
+            for row in rows:
+                serialize(row)
+            tuples = time.perf_counter() - start
+            results[model.__name__ + ".serialize"] = {
+                "rows": len(instances),
+                "orm_us_per_row": round(orm / max(len(instances), 1) * 1e6, 3),
+                "row_tuple_us_per_row": round(tuples / max(len(rows), 1) * 1e6, 3),
+            }
+            db.session.expunge_all()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_seed_arguments(parser)
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--serialize-rows", type=int, default=5000)
+    parser.add_argument("--cache", action="store_true", help="keep the response cache on")
+    parser.add_argument("--only", nargs="*", help="handler names to run")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    configure(args.database_url, args.cache)
+    app = seed(args)
+    from models import db
+    counter = QueryCounter()
+    with app.app_context():
+        counter.install(db.engine)
+    results = {"handlers": bench_handlers(app, args, counter), "serialize": bench_serialize(app, args)}
+    report("handlers", vars(args), results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+HTTP load scenario: a weighted mix of catalog list and detail reads, favorites
+reads and favorite add/remove toggles, driven by concurrent keep-alive clients.
+
+By default the app is served in-process by a threaded WSGI server, which also
+lets the report include queries per request. Pass --url to load an already
+running deployment (gunicorn, uvicorn) instead; it still has to use the
+database this script seeds.
+
+    $ pipenv run python benchmarks/load.py --concurrency 16 --duration 15 --output load.json
+"""
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+from urllib.parse import urlparse
+from common import configure, add_seed_arguments, seed, QueryCounter, percentiles, report
+
+# scenario -> share of the requests
+MIX = {"list": 0.4, "detail": 0.3, "favorites_read": 0.2, "favorite_toggle": 0.1}
+
+
+class Client:
+    def __init__(self, host, port, args, user_id):
+        self.connection = http.client.HTTPConnection(host, port, timeout=30)
+        self.host, self.port = host, port
+        self.args = args
+        self.user_id = user_id
+        self.favorite = None
+
+    def request(self, method, path, body=None):
+        headers = {}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        try:
+            self.connection.request(method, path, payload, headers)
+            response = self.connection.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            self.connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            return None
+
+    def run(self, scenario):
+        args = self.args
+        if scenario == "list":
+            kind = random.choice(["characters", "episodes", "locations"])
+            return self.request("GET", "/%s?after=%d" % (kind, random.randrange(0, args.characters, 50) if kind == "characters" else 0))
+        if scenario == "detail":
+            return self.request("GET", "/characters/%d" % random.randint(1, args.characters))
+        if scenario == "favorites_read":
+            return self.request("GET", "/user/%d/favorites" % random.randint(1, args.users))
+        # Each client owns a user without seeded favorites and flips one favorite on and off
+        if self.favorite is None:
+            self.favorite = random.randint(1, args.characters)
+            return self.request("POST", "/user/%d/favorites/characters/%d" % (self.user_id, self.favorite),
+                                {"character_id": self.favorite})
+        status = self.request("DELETE", "/user/%d/favorites/characters/%d" % (self.user_id, self.favorite))
+        self.favorite = None
+        return status
+
+
+def run_load(host, port, args, counter):
+    scenarios, weights = zip(*MIX.items())
+    samples = {x: [] for x in scenarios}
+    errors = {x: 0 for x in scenarios}
+    lock = threading.Lock()
+    stop_at = time.time() + args.duration
+
+    def worker(index):
+        client = Client(host, port, args, args.users + 1 + index)
+        local = {x: [] for x in scenarios}
+        local_errors = {x: 0 for x in scenarios}
+        while time.time() < stop_at:
+            scenario = random.choices(scenarios, weights)[0]
+            start = time.perf_counter()
+            status = client.run(scenario)
+            elapsed = time.perf_counter() - start
+            if status == 200:
+                local[scenario].append(elapsed)
+            else:
+                local_errors[scenario] += 1
+        if client.favorite is not None:
+            client.run("favorite_toggle")
+        with lock:
+            for x in scenarios:
+                samples[x].extend(local[x])
+                errors[x] += local_errors[x]
+
+    if counter is not None:
+        counter.take()
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(x,)) for x in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    queries = counter.take() if counter is not None else None
+
+    total = sum(len(x) for x in samples.values())
+    results = {"scenarios": {}}
+    for scenario in scenarios:
+        results["scenarios"][scenario] = dict(percentiles(samples[scenario]),
+                                              requests=len(samples[scenario]),
+                                              errors=errors[scenario])
+    results["overall"] = dict(percentiles([y for x in samples.values() for y in x]),
+                              requests=total,
+                              errors=sum(errors.values()),
+                              rps=round(total / elapsed, 1),
+                              queries_per_request=round(queries / total, 2) if queries is not None and total else None)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_seed_arguments(parser)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--url", help="load an external server instead of the in-process one")
+    parser.add_argument("--cache", action="store_true", help="keep the response cache on")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    configure(args.database_url, args.cache)
+    app = seed(args)
+    from models import db, User
+    with app.app_context():
+        db.session.execute(User.__table__.insert(), [
+            {"id": args.users + 1 + x, "username": "load%d" % x, "first_name": "L", "last_name": "L",
+             "email": "load%d@example.com" % x, "password": "x", "is_active": True}
+            for x in range(args.concurrency)
+        ])
+        db.session.commit()
+
+    if args.url:
+        url = urlparse(args.url)
+        results = run_load(url.hostname, url.port or 80, args, None)
+    else:
+        from werkzeug.serving import make_server
+        counter = QueryCounter()
+        with app.app_context():
+            counter.install(db.engine)
+        server = make_server("127.0.0.1", 0, app, threaded=True)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            results = run_load("127.0.0.1", server.server_port, args, counter)
+        finally:
+            server.shutdown()
+    report("load", vars(args), results, args.output)
+
+
+if __name__ == "__main__":
+    main()
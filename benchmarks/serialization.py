@@ -0,0 +1,83 @@
+"""
+Compares the legacy ORM + serialize() + jsonify path against the column-row
+serializer with the stdlib and orjson backends on a seeded Character table.
+
+    $ pipenv run python benchmarks/serialization.py --rows 100000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+# Always in-memory: seed() empties the Character table, and pipenv loads .env
+os.environ["DATABASE_URL"] = "sqlite://"
+
+from flask import jsonify  # noqa: E402
+from app import app  # noqa: E402
+from models import db, Character  # noqa: E402
+from utils import select_fields  # noqa: E402
+import serialization  # noqa: E402
+
+
+def seed(rows):
+    db.create_all()
+    db.session.query(Character).delete()
+    db.session.execute(Character.__table__.insert(), [
+        {"id": i, "character_name": "Character %d" % i, "gender": "Female" if i % 2 else "Male",
+         "alive": bool(i % 3), "species": "Human"}
+        for i in range(1, rows + 1)
+    ])
+    db.session.commit()
+
+
+def best_of(repeat, fn):
+    timings = []
+    for _ in range(repeat):
+        db.session.expunge_all()
+        start = time.perf_counter()
+        body = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings), body
+
+
+def legacy():
+    return jsonify({"body": [x.serialize() for x in Character.query.all()]}).get_data()
+
+
+def rows():
+    query, serialize = select_fields(Character, sparse=False)
+    return serialization.json_response({"body": [serialize(x) for x in query.all()]}).get_data()
+
+
+# Catalog rows hold no floats; these are the kinds the API sends (search
+# scores, durations in ms), within the range both backends write alike.
+FLOAT_SAMPLE = {"scores": [0.5, 0.667, 1.0, 1 / 3], "ms": [0.001, 12.345, 1500.0]}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with app.test_request_context():
+        seed(args.rows)
+        results = {}
+        results["orm+serialize()+jsonify"], _ = best_of(args.repeat, legacy)
+        outputs = {}
+        for backend in serialization.BACKENDS:
+            serialization.set_backend(backend)
+            results["rows+" + backend], outputs[backend] = best_of(args.repeat, rows)
+            outputs[backend] += serialization.dumps(FLOAT_SAMPLE)
+        if len(set(outputs.values())) != 1:
+            sys.exit("Backends produced different bytes")
+
+    print("%d rows, best of %d" % (args.rows, args.repeat))
+    for name, seconds in results.items():
+        print("  %-26s %8.1f ms" % (name, seconds * 1000))
+    print("  backends byte-identical:  yes (%s)" % ", ".join(outputs))
+
+
+if __name__ == "__main__":
+    main()
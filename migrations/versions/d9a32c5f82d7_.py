@@ -0,0 +1,55 @@
+"""empty message
+
+Revision ID: d9a32c5f82d7
+Revises: 94082dd1099b
+Create Date: 2026-10-18 10:12:41.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd9a32c5f82d7'
+down_revision = '94082dd1099b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('character', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_character_alive'), ['alive'], unique=False)
+        batch_op.create_index(batch_op.f('ix_character_character_name'), ['character_name'], unique=False)
+        batch_op.create_index(batch_op.f('ix_character_gender'), ['gender'], unique=False)
+        batch_op.create_index(batch_op.f('ix_character_species'), ['species'], unique=False)
+
+    with op.batch_alter_table('location', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_location_dimension'), ['dimension'], unique=False)
+        batch_op.create_index(batch_op.f('ix_location_location_type'), ['location_type'], unique=False)
+
+    # Postgres only uses a b-tree for LIKE 'prefix%' under the C collation or
+    # with pattern ops, and needs trigram GIN indexes for ILIKE '%substring%'.
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for table, column in (('character', 'character_name'), ('episode', 'episode_name'), ('location', 'location_name')):
+            op.create_index('ix_%s_%s_prefix' % (table, column), table, [column],
+                            postgresql_ops={column: 'varchar_pattern_ops'})
+            op.create_index('ix_%s_%s_trgm' % (table, column), table, [column],
+                            postgresql_using='gin', postgresql_ops={column: 'gin_trgm_ops'})
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        for table, column in (('character', 'character_name'), ('episode', 'episode_name'), ('location', 'location_name')):
+            op.drop_index('ix_%s_%s_trgm' % (table, column), table_name=table)
+            op.drop_index('ix_%s_%s_prefix' % (table, column), table_name=table)
+
+    with op.batch_alter_table('location', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_location_location_type'))
+        batch_op.drop_index(batch_op.f('ix_location_dimension'))
+
+    with op.batch_alter_table('character', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_character_species'))
+        batch_op.drop_index(batch_op.f('ix_character_gender'))
+        batch_op.drop_index(batch_op.f('ix_character_character_name'))
+        batch_op.drop_index(batch_op.f('ix_character_alive'))
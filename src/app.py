@@ -2,13 +2,26 @@
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
 import os
-from flask import Flask, request, jsonify, url_for
+from flask import Flask, request, url_for
 from flask_migrate import Migrate
 from flask_swagger import swagger
 from flask_cors import CORS
-from utils import APIException, generate_sitemap
+from utils import APIException, generate_sitemap, get_int_arg, select_fields, apply_filters, paginate, fetch_by_ids, wants_stream, stream_ndjson, conditional_response, request_body, upsert_statement
 from admin import setup_admin
-from models import db, User, Character, Episode, Location
+from cache import setup_cache, cached_response
+from versions import setup_versions
+from compression import setup_compression
+from serialization import json_response, row_serializer
+from pool import engine_options, setup_pool, get_pool_status
+from catalog import setup_catalog
+from snapshot import setup_snapshot, serve_from_snapshot
+from counters import setup_counters, adjust_favorite_counts, release_user_favorite_counts, top_favorites_query
+from instrumentation import setup_instrumentation, query_budget
+from metrics import setup_metrics
+from sqlite_mode import setup_sqlite, serialized_write, get_write_stats
+from replicas import setup_replicas, stick_to_primary, replica_set
+from search import setup_search, search_index, ensure_search_index, MAX_RESULTS
+from models import db, User, Character, Episode, Location, character_favs, location_favs, episode_favs, episodes__characters, characters__locations, foreign_key_column
 #from models import Person
 
 app = Flask(__name__)
@@ -20,48 +33,95 @@ if db_url is not None:
 else:
     app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+app.config['RESPONSE_CACHE_MAX_ENTRIES'] = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 512))
+app.config['RESPONSE_CACHE_MAX_BYTES'] = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+app.config['RESPONSE_CACHE_TTL'] = int(os.getenv("RESPONSE_CACHE_TTL", 300))
+app.config['CATALOG_VERSION_DIR'] = os.getenv("CATALOG_VERSION_DIR")
+app.config['SEARCH_INDEX_MAX_AGE'] = int(os.getenv("SEARCH_INDEX_MAX_AGE", 300))
+app.config['CATALOG_SNAPSHOT_PATH'] = os.getenv("CATALOG_SNAPSHOT_PATH")
+app.config['COMPRESSION_MIN_SIZE'] = int(os.getenv("COMPRESSION_MIN_SIZE", 1024))
+app.config['COMPRESSION_GZIP_LEVEL'] = int(os.getenv("COMPRESSION_GZIP_LEVEL", 6))
+app.config['COMPRESSION_BROTLI_QUALITY'] = int(os.getenv("COMPRESSION_BROTLI_QUALITY", 5))
+app.config['SQLITE_PRODUCTION_MODE'] = os.getenv("SQLITE_PRODUCTION_MODE", "0") == "1"
+app.config['DATABASE_REPLICA_URLS'] = os.getenv("DATABASE_REPLICA_URLS", "")
+app.config['REPLICA_EJECT_SECONDS'] = int(os.getenv("REPLICA_EJECT_SECONDS", 30))
+app.config['REPLICA_STICKY_SECONDS'] = int(os.getenv("REPLICA_STICKY_SECONDS", 5))
+app.config['SERVER_TIMING'] = os.getenv("SERVER_TIMING", "1") == "1"
+app.config['SLOW_REQUEST_MS'] = float(os.getenv("SLOW_REQUEST_MS", 500))
+app.config['QUERY_BUDGET_STRICT'] = os.getenv("QUERY_BUDGET_STRICT", "0") == "1"
+
+MAX_BULK_FAVORITES = 1000
+MAX_TOP_FAVORITES = 100
 
 MIGRATE = Migrate(app, db)
 db.init_app(app)
+setup_pool(app)
+setup_replicas(app)
+setup_sqlite(app)
+setup_instrumentation(app)
+setup_metrics(app)
 CORS(app)
 setup_admin(app)
+setup_versions(app)
+setup_cache(app)
+setup_compression(app)
+setup_search(app)
+setup_counters(app)
+setup_catalog(app)
+setup_snapshot(app)
 
 # Handle/serialize errors like a JSON object
 @app.errorhandler(APIException)
 def handle_invalid_usage(error):
-    return jsonify(error.to_dict()), error.status_code
+    return json_response(error.to_dict()), error.status_code
 
 # generate sitemap with all your endpoints
 @app.route('/')
 def sitemap():
     return generate_sitemap(app)
 
+@app.route('/stats/pool', methods=['GET'])
+def pool_status():
+    status = get_pool_status()
+    if replica_set.replicas:
+        status["replicas"] = replica_set.status()
+    write_stats = get_write_stats()
+    if write_stats is not None:
+        status["sqlite_writes"] = write_stats
+    return json_response(status), 200
+
 
 # ACA EMPEZAMOS LOS ENDPOINTS
 
 # --------------------------USERS--------------------------
 
 @app.route('/users', methods=['GET'])
+@query_budget(1)
 def get_all_users():
-    users = User.query.all()
-    user_serialized = [x.serialize() for x in users]
-    return jsonify({"body" : user_serialized}), 200
+    query, serialize = select_fields(User)
+    users, next_cursor = paginate(query, User)
+    user_serialized = [serialize(x) for x in users]
+    return json_response({"body" : user_serialized, "next": next_cursor}), 200
 
 
 @app.route('/user_register', methods=['POST'])
+@query_budget(2)
+@serialized_write
 def user_register():
-    body_username = request.json.get("username")
-    body_first_name= request.json.get("first_name")
-    body_last_name = request.json.get("last_name")
-    body_email = request.json.get("email")
-    body_password = request.json.get("password")
+    body = request_body()
+    body_username = body.get("username")
+    body_first_name= body.get("first_name")
+    body_last_name = body.get("last_name")
+    body_email = body.get("email")
+    body_password = body.get("password")
     user_already_exist = User.query.filter_by(email= body_email).first()
     if user_already_exist:
-        return jsonify({"response": "Email already used"}), 300
+        return json_response({"response": "Email already used"}), 300
     new_user = User (username=body_username, first_name=body_first_name, last_name=body_last_name ,email=body_email, password=body_password)
     db.session.add(new_user)
     db.session.commit()
-    return jsonify({"response": "User registered successfully"}), 200 
+    return json_response({"response": "User registered successfully"}), 200 
 
 @app.route('/user/<int:user_id>', methods=['DELETE'])
 def delete_user_by_id(user_id):
@@ -70,205 +130,461 @@ def delete_user_by_id(user_id):
         response_body = {
             "msg" : "This user doesn't exist, can't be deleted."
         }
-        return jsonify(response_body), 200
+        return json_response(response_body), 200
+    release_user_favorite_counts(user_id)
     db.session.delete(user_query)
     db.session.commit()
     response_body = {
         "msg" : "User deleted correctly !"
     }
-    return jsonify(response_body), 200
+    return json_response(response_body), 200
 
 #  --------------------------CHARACTERS--------------------------
 
 @app.route('/characters', methods=['GET'])
+@query_budget(1)
+@cached_response(Character)
 def get_all_characters():
-    characters = Character.query.all()
-    characters_serialized = [x.serialize() for x in characters]
-    return jsonify({"body" : characters_serialized}), 200
+    snapshot_response = serve_from_snapshot(Character)
+    if snapshot_response is not None:
+        return snapshot_response
+    query, serialize = select_fields(Character)
+    query = apply_filters(query, Character)
+    if wants_stream():
+        return stream_ndjson(query, Character, serialize)
+    if "ids" in request.args:
+        characters, missing = fetch_by_ids(query, Character)
+        return json_response({"body" : [serialize(x) for x in characters], "missing": missing}), 200
+    characters, next_cursor = paginate(query, Character)
+    characters_serialized = [serialize(x) for x in characters]
+    return json_response({"body" : characters_serialized, "next": next_cursor}), 200
 
 @app.route('/characters/<int:character_id>', methods=['GET'])
+@query_budget(1)
+@cached_response(Character)
 def get_character_by_id(character_id):
-    character_query = Character.query.get(character_id)
+    snapshot_response = serve_from_snapshot(Character, character_id)
+    if snapshot_response is not None:
+        return snapshot_response
+    query, serialize = select_fields(Character)
+    character_query = query.filter(Character.id == character_id).first()
     
     if not character_query:
         response_body = {
             "msg" : "The user you are looking for doesn't exist."
         }
-        return jsonify(response_body), 200
+        return json_response(response_body), 200
 
-    character_serialize = character_query.serialize()
-    return jsonify({"Result": character_serialize}), 200
+    character_serialize = serialize(character_query)
+    return json_response({"Result": character_serialize}), 200
 
 #  -------------------------- EPISODES --------------------------
 
 @app.route('/episodes', methods=['GET'])
+@query_budget(1)
+@cached_response(Episode)
 def get_all_episodes():
-    episodes = Episode.query.all()
-    episodes_serialized = [x.serialize() for x in episodes]
-    return jsonify({"body" : episodes_serialized}), 200
+    snapshot_response = serve_from_snapshot(Episode)
+    if snapshot_response is not None:
+        return snapshot_response
+    query, serialize = select_fields(Episode)
+    query = apply_filters(query, Episode)
+    if wants_stream():
+        return stream_ndjson(query, Episode, serialize)
+    if "ids" in request.args:
+        episodes, missing = fetch_by_ids(query, Episode)
+        return json_response({"body" : [serialize(x) for x in episodes], "missing": missing}), 200
+    episodes, next_cursor = paginate(query, Episode)
+    episodes_serialized = [serialize(x) for x in episodes]
+    return json_response({"body" : episodes_serialized, "next": next_cursor}), 200
 
 @app.route('/episodes/<int:episode_id>', methods=['GET'])
+@query_budget(1)
+@cached_response(Episode)
 def get_episode_by_id(episode_id):
-    episode_query = Episode.query.get(episode_id)
+    snapshot_response = serve_from_snapshot(Episode, episode_id)
+    if snapshot_response is not None:
+        return snapshot_response
+    query, serialize = select_fields(Episode)
+    episode_query = query.filter(Episode.id == episode_id).first()
     
     if not episode_query:
         response_body = {
             "msg" : "The user you are looking for doesn't exist."
         }
-        return jsonify(response_body), 200
+        return json_response(response_body), 200
 
-    episode_serialize = episode_query.serialize()
-    return jsonify({"Result": episode_serialize}), 200
+    episode_serialize = serialize(episode_query)
+    return json_response({"Result": episode_serialize}), 200
 
 #  ------------- LOCATIONS --------------------------
 
 @app.route('/locations', methods=['GET'])
+@query_budget(1)
+@cached_response(Location)
 def get_all_locations():
-    locations = Location.query.all()
-    locations_serialized = [x.serialize() for x in locations]
-    return jsonify({"body" : locations_serialized}), 200
+    snapshot_response = serve_from_snapshot(Location)
+    if snapshot_response is not None:
+        return snapshot_response
+    query, serialize = select_fields(Location)
+    query = apply_filters(query, Location)
+    if wants_stream():
+        return stream_ndjson(query, Location, serialize)
+    if "ids" in request.args:
+        locations, missing = fetch_by_ids(query, Location)
+        return json_response({"body" : [serialize(x) for x in locations], "missing": missing}), 200
+    locations, next_cursor = paginate(query, Location)
+    locations_serialized = [serialize(x) for x in locations]
+    return json_response({"body" : locations_serialized, "next": next_cursor}), 200
 
 
 @app.route('/locations/<int:location_id>', methods=['GET'])
+@query_budget(1)
+@cached_response(Location)
 def get_location_by_id(location_id):
-    location_query = Location.query.get(location_id)
+    snapshot_response = serve_from_snapshot(Location, location_id)
+    if snapshot_response is not None:
+        return snapshot_response
+    query, serialize = select_fields(Location)
+    location_query = query.filter(Location.id == location_id).first()
     
     if not location_query:
         response_body = {
             "msg" : "The user you are looking for doesn't exist."
         }
-        return jsonify(response_body), 200
-
-    location_serialize = location_query.serialize()
-    return jsonify({"Result": location_serialize}), 200
+        return json_response(response_body), 200
+
+    location_serialize = serialize(location_query)
+    return json_response({"Result": location_serialize}), 200
+
+#  ------------- RELATIONS --------------------------
+
+def check_exists(model, object_id):
+    if db.session.query(model.id).filter_by(id=object_id).scalar() is None:
+        raise APIException("The " + model.__tablename__ + " you are looking for doesn't exist.", status_code=404)
+
+def get_related_page(model, association_table, parent_column, parent_id):
+    # One keyset page of the related rows through a single join, so a full
+    # episode cast costs the same two queries however many characters it has.
+    foreign_key = foreign_key_column(association_table, model)
+    query, serialize = select_fields(model)
+    query = query.join(association_table, foreign_key == model.id).filter(parent_column == parent_id)
+    rows, next_cursor = paginate(query, model)
+    return json_response({"body": [serialize(x) for x in rows], "next": next_cursor}), 200
+
+@app.route('/episodes/<int:episode_id>/characters', methods=['GET'])
+@query_budget(2)
+@conditional_response
+def get_episode_characters(episode_id):
+    check_exists(Episode, episode_id)
+    return get_related_page(Character, episodes__characters, episodes__characters.c.episode_id, episode_id)
+
+@app.route('/characters/<int:character_id>/episodes', methods=['GET'])
+@query_budget(2)
+@conditional_response
+def get_character_episodes(character_id):
+    check_exists(Character, character_id)
+    return get_related_page(Episode, episodes__characters, episodes__characters.c.character_id, character_id)
+
+@app.route('/locations/<int:location_id>/residents', methods=['GET'])
+@query_budget(2)
+@conditional_response
+def get_location_residents(location_id):
+    check_exists(Location, location_id)
+    return get_related_page(Character, characters__locations, characters__locations.c.location_id, location_id)
+
+#  ------------- MOST FAVORITED --------------------------
+
+def get_top_favorites(model):
+    limit = get_int_arg("limit", 10)
+    if limit < 1 or limit > MAX_TOP_FAVORITES:
+        raise APIException("'limit' must be between 1 and " + str(MAX_TOP_FAVORITES), status_code=400)
+    serialize = row_serializer(list(model.serialize_fields) + ["favorites"])
+    rows = top_favorites_query(model, limit).all()
+    return json_response({"body": [serialize(x) for x in rows]}), 200
+
+@app.route('/characters/top', methods=['GET'])
+@query_budget(1)
+@conditional_response
+def get_top_characters():
+    return get_top_favorites(Character)
+
+@app.route('/episodes/top', methods=['GET'])
+@query_budget(1)
+@conditional_response
+def get_top_episodes():
+    return get_top_favorites(Episode)
+
+@app.route('/locations/top', methods=['GET'])
+@query_budget(1)
+@conditional_response
+def get_top_locations():
+    return get_top_favorites(Location)
+
+#  ------------- SEARCH --------------------------
+
+@app.route('/search', methods=['GET'])
+def search_catalog():
+    query = request.args.get("q", "").strip()
+    if not query:
+        raise APIException("'q' is required", status_code=400)
+    limit = get_int_arg("limit", 10)
+    if limit < 1 or limit > MAX_RESULTS:
+        raise APIException("'limit' must be between 1 and " + str(MAX_RESULTS), status_code=400)
+    ensure_search_index()
+    results = search_index.search(query, limit=limit, kind=request.args.get("type"))
+    return json_response({"body": results}), 200
 
 #  ------------- FAVORITES --------------------------
 
+def check_user_exists(user_id):
+    # Only the primary key: no User row, no favorites collections.
+    if db.session.query(User.id).filter_by(id=user_id).scalar() is None:
+        raise APIException("This user doesn't exist.", status_code=404)
+
+FAVORITE_KINDS = {
+    "characters": (Character, character_favs),
+    "locations": (Location, location_favs),
+    "episodes": (Episode, episode_favs),
+}
+
+def get_favorites(model, association_table, user_id, sparse=True):
+    foreign_key = foreign_key_column(association_table, model)
+    # ?fields= names the columns of one model, so it only applies to the single-kind endpoints
+    query, serialize = select_fields(model, sparse)
+    favorites = (query
+                 .join(association_table, foreign_key == model.id)
+                 .filter(association_table.c.user_id == user_id)
+                 .order_by(model.id)
+                 .all())
+    return [serialize(x) for x in favorites]
+
 @app.route('/user/<int:user_id>/favorites', methods=['GET'])
+@query_budget(4)
+@conditional_response
 def get_all_user_favorites(user_id):
-    favorites_characters = User.query.filter_by(id=user_id).first().charactersFav
-    favorites_locations = User.query.filter_by(id=user_id).first().locationsFav
-    favorites_episodes = User.query.filter_by(id=user_id).first().episodesFav
-    Characters = [x.serialize() for x in favorites_characters]
-    Locations = [x.serialize() for x in favorites_locations]
-    Episodes = [x.serialize() for x in favorites_episodes]
-
-    return jsonify({
-        "charactersFav": Characters,
-        "locationsFav": Locations,
-        "episodesFav": Episodes
+    check_user_exists(user_id)
+
+    return json_response({
+        "charactersFav": get_favorites(Character, character_favs, user_id, sparse=False),
+        "locationsFav": get_favorites(Location, location_favs, user_id, sparse=False),
+        "episodesFav": get_favorites(Episode, episode_favs, user_id, sparse=False)
     }), 200    
 
 
 @app.route('/user/<int:user_id>/favorites/character', methods=['GET'])
+@query_budget(2)
+@conditional_response
 def get_character_user_favorites(user_id):
-    favorites_characters = User.query.filter_by(id=user_id).first().charactersFav
-    Characters = [x.serialize() for x in favorites_characters]
+    check_user_exists(user_id)
 
-    return jsonify({
-        "charactersFav": Characters,
+    return json_response({
+        "charactersFav": get_favorites(Character, character_favs, user_id),
     }), 200 
 
 
 @app.route('/user/<int:user_id>/favorites/location', methods=['GET'])
+@query_budget(2)
+@conditional_response
 def get_location_user_favorites(user_id):
-    favorites_locations = User.query.filter_by(id=user_id).first().locationsFav
-    Locations = [x.serialize() for x in favorites_locations]
+    check_user_exists(user_id)
 
-    return jsonify({
-        "locationsFav": Locations,
+    return json_response({
+        "locationsFav": get_favorites(Location, location_favs, user_id),
     }), 200 
 
 
 @app.route('/user/<int:user_id>/favorites/episode', methods=['GET'])
+@query_budget(2)
+@conditional_response
 def get_episode_user_favorites(user_id):
-    favorites_episodes = User.query.filter_by(id=user_id).first().episodesFav
-    Episodes = [x.serialize() for x in favorites_episodes]
+    check_user_exists(user_id)
 
-    return jsonify({
-        "episodesFav": Episodes
+    return json_response({
+        "episodesFav": get_favorites(Episode, episode_favs, user_id)
     }), 200 
 
+def favorite_target(key, object_id):
+    # The id is in the URL; older clients also repeat it in the body
+    if request.content_length:
+        body = request_body() or {}
+        if not isinstance(body, dict):
+            raise APIException("The body must be an object", status_code=400)
+        body_id = body.get(key, object_id)
+        if str(body_id) != str(object_id):
+            raise APIException("'" + key + "' doesn't match the URL", status_code=400)
+    return object_id
+
+def check_favorite_target(user_id, model, object_id):
+    check_user_exists(user_id)
+    if db.session.query(model.id).filter_by(id=object_id).scalar() is None:
+        raise APIException("This " + model.__tablename__ + " doesn't exist.", status_code=404)
+
+def add_favorite(user_id, model, association_table, object_id):
+    # One INSERT ... SELECT: the SELECT only yields a row when both the user
+    # and the target exist, and a favorite that is already there is skipped.
+    # The existence checks only run when nothing was inserted.
+    foreign_key = foreign_key_column(association_table, model)
+    # Both sides are filtered down to at most one row, so the cross join is intended
+    rows = (db.select(User.id, model.id)
+            .join_from(User, model, db.true())
+            .where(User.id == user_id, model.id == object_id))
+    statement = (upsert_statement(association_table, ["user_id", foreign_key.name])
+                 .from_select(["user_id", foreign_key.name], rows))
+    if db.session.execute(statement).rowcount:
+        adjust_favorite_counts(model, [object_id], 1)
+    else:
+        check_favorite_target(user_id, model, object_id)
+    db.session.commit()
+    stick_to_primary(user_id)
+
+def remove_favorite(user_id, model, association_table, object_id):
+    foreign_key = foreign_key_column(association_table, model)
+    statement = association_table.delete().where(association_table.c.user_id == user_id, foreign_key == object_id)
+    if db.session.execute(statement).rowcount:
+        adjust_favorite_counts(model, [object_id], -1)
+    else:
+        check_favorite_target(user_id, model, object_id)
+    db.session.commit()
+    stick_to_primary(user_id)
+
 # ADD FAVORITE CHARACTER
 @app.route('/user/<int:user_id>/favorites/characters/<int:character_id>', methods=['POST'])
+@query_budget(3)
+@serialized_write
 def add_character_favorite(user_id, character_id):
-    
-    user = User.query.get(user_id)
-    body_character_id = request.json.get("character_id")
-    character = Character.query.get(body_character_id)
+    add_favorite(user_id, Character, character_favs, favorite_target("character_id", character_id))
 
-    user.charactersFav.append(character)
-
-    db.session.commit()
-
-    return jsonify({"response": "Character added to favorites"}), 200
+    return json_response({"response": "Character added to favorites"}), 200
 
 # ADD FAVORITE LOCATION
 @app.route('/user/<int:user_id>/favorites/locations/<int:location_id>', methods=['POST'])
+@query_budget(3)
+@serialized_write
 def add_location_favorite(user_id, location_id):
-    
-    user = User.query.get(user_id)
-    body_location_id = request.json.get("location_id")
-    location = Location.query.get(body_location_id)
+    add_favorite(user_id, Location, location_favs, favorite_target("location_id", location_id))
 
-    user.locationsFav.append(location)
-
-    db.session.commit()
-
-    return jsonify({"response": "Location added to favorites"}), 200
+    return json_response({"response": "Location added to favorites"}), 200
 
 # ADD FAVORITE EPISODE
 @app.route('/user/<int:user_id>/favorites/episodes/<int:episode_id>', methods=['POST'])
+@query_budget(3)
+@serialized_write
 def add_episode_favorite(user_id, episode_id):
-    
-    user = User.query.get(user_id)
-    body_episode_id = request.json.get("episode_id")
-    episode = Episode.query.get(body_episode_id)
+    add_favorite(user_id, Episode, episode_favs, favorite_target("episode_id", episode_id))
 
-    user.episodesFav.append(episode)
-
-    db.session.commit()
-
-    return jsonify({"response": "Episode added to favorites"}), 200
+    return json_response({"response": "Episode added to favorites"}), 200
 
 # DELETE FAVORITE CHARACTER
 @app.route('/user/<int:user_id>/favorites/characters/<int:character_id>', methods=['DELETE'])
+@query_budget(3)
+@serialized_write
 def remove_character_favorite(user_id, character_id):
-    
-    user = User.query.get(user_id)
-    body_character_id = Character.query.get(character_id)
+    remove_favorite(user_id, Character, character_favs, character_id)
 
-    user.charactersFav.remove(body_character_id)
+    return json_response({"response": "Character removed from favorites"}), 200
 
-    db.session.commit()
-
-    return jsonify({"response": "Character removed from favorites"}), 200
-
-# DELETE LOCATION CHARACTER
+# DELETE FAVORITE LOCATION
 @app.route('/user/<int:user_id>/favorites/locations/<int:location_id>', methods=['DELETE'])
+@query_budget(3)
+@serialized_write
 def remove_location_favorite(user_id, location_id):
-    
-    user = User.query.get(user_id)
-    location = Location.query.get(location_id)
+    remove_favorite(user_id, Location, location_favs, location_id)
 
-    user.locationsFav.remove(location)
+    return json_response({"response": "Location removed from favorites"}), 200
 
-    db.session.commit()
-
-    return jsonify({"response": "Location removed from favorites"}), 200
-
-
-@app.route('/user/<int:user_id>/favorites/episodes/<int:episode_id>', methods=['POST'])
+# DELETE FAVORITE EPISODE
+@app.route('/user/<int:user_id>/favorites/episodes/<int:episode_id>', methods=['DELETE'])
+@query_budget(3)
+@serialized_write
 def remove_episode_favorite(user_id, episode_id):
-    
-    user = User.query.get(user_id)
-    episode = Episode.query.get(episode_id)
-
-    user.episodesFav.remove(episode)
-
+    remove_favorite(user_id, Episode, episode_favs, episode_id)
+
+    return json_response({"response": "Episode removed from favorites"}), 200
+
+# BULK ADD/REMOVE FAVORITES
+def get_bulk_ids(body, action, kind):
+    ids = body[action].get(kind, [])
+    if not isinstance(ids, list) or not all(isinstance(x, int) and not isinstance(x, bool) for x in ids):
+        raise APIException("'" + action + "." + kind + "' must be a list of integers", status_code=400)
+    if len(ids) > MAX_BULK_FAVORITES:
+        raise APIException("At most " + str(MAX_BULK_FAVORITES) + " ids per list", status_code=400)
+    return set(ids)
+
+def write_favorites(user_id, association_table, foreign_key, object_ids, insert):
+    # Returns the ids actually inserted (skipped on conflict, like the single
+    # add) or deleted: a concurrent request may have changed some of them
+    # since they were read. MySQL has no RETURNING, so there each id gets its
+    # own statement and its rowcount.
+    def statement_for(ids):
+        if insert:
+            return (upsert_statement(association_table, ["user_id", foreign_key.name])
+                    .values([{"user_id": user_id, foreign_key.name: x} for x in ids]))
+        return association_table.delete().where(association_table.c.user_id == user_id, foreign_key.in_(ids))
+
+    object_ids = sorted(object_ids)
+    dialect = db.session.get_bind().dialect
+    if dialect.insert_returning if insert else dialect.delete_returning:
+        return sorted(db.session.execute(statement_for(object_ids).returning(foreign_key)).scalars())
+    return [x for x in object_ids if db.session.execute(statement_for([x])).rowcount]
+
+def apply_favorite_changes(user_id, model, association_table, add_ids, remove_ids):
+    # Set difference against what the user already has, then one multi-row
+    # INSERT and one DELETE. The caller commits once for every kind.
+    foreign_key = foreign_key_column(association_table, model)
+    current = set(db.session.execute(
+        db.select(foreign_key).where(association_table.c.user_id == user_id)
+    ).scalars())
+    to_add = add_ids - current
+    missing = set()
+    if to_add:
+        existing = set(db.session.execute(
+            db.select(model.id).where(model.id.in_(to_add))
+        ).scalars())
+        missing = to_add - existing
+        to_add = existing
+    to_remove = remove_ids & current
+    added = write_favorites(user_id, association_table, foreign_key, to_add, insert=True) if to_add else []
+    removed = write_favorites(user_id, association_table, foreign_key, to_remove, insert=False) if to_remove else []
+    return added, removed, sorted(missing)
+
+@app.route('/user/<int:user_id>/favorites', methods=['PATCH'])
+@query_budget(19)
+@serialized_write
+def update_user_favorites(user_id):
+    check_user_exists(user_id)
+    body = request_body() or {}
+    if not isinstance(body, dict):
+        raise APIException("The body must be an object with 'add' and/or 'remove'", status_code=400)
+    for action in ("add", "remove"):
+        body[action] = body.get(action, {})
+        if not isinstance(body[action], dict):
+            raise APIException("'" + action + "' must be an object of id lists", status_code=400)
+        unknown = set(body[action]) - set(FAVORITE_KINDS)
+        if unknown:
+            raise APIException("Unknown kinds in '" + action + "': " + ", ".join(sorted(unknown)) +
+                               "; use " + ", ".join(FAVORITE_KINDS), status_code=400)
+    changes = {}
+    for kind in FAVORITE_KINDS:
+        add_ids = get_bulk_ids(body, "add", kind)
+        remove_ids = get_bulk_ids(body, "remove", kind)
+        if add_ids & remove_ids:
+            raise APIException("The same " + kind + " id can't be added and removed", status_code=400)
+        changes[kind] = (add_ids, remove_ids)
+
+    response_body = {"added": {}, "removed": {}, "missing": {}}
+    for kind, (model, association_table) in FAVORITE_KINDS.items():
+        add_ids, remove_ids = changes[kind]
+        added, removed, missing = apply_favorite_changes(user_id, model, association_table, add_ids, remove_ids)
+        adjust_favorite_counts(model, added, 1)
+        adjust_favorite_counts(model, removed, -1)
+        response_body["added"][kind] = added
+        response_body["removed"][kind] = removed
+        response_body["missing"][kind] = missing
     db.session.commit()
+    stick_to_primary(user_id)
 
-    return jsonify({"response": "Episode added to favorites"}), 200
+    return json_response(response_body), 200
 
 # this only runs if `$ python src/app.py` is executed
 if __name__ == '__main__':
@@ -0,0 +1,186 @@
+"""
+Async deployment mode. The hot catalog and favorites reads run on an async
+SQLAlchemy engine (asyncpg/aiosqlite) so one worker keeps many requests in
+flight while they wait on the database; every other request is handed to the
+Flask app in src/app.py through a WSGI bridge.
+
+    $ pipenv run start-async
+"""
+import re
+from a2wsgi import WSGIMiddleware
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine
+from starlette.requests import Request
+from starlette.responses import Response
+from app import app as flask_app
+from cache import response_cache, CACHED_MODELS
+from versions import shared_versions
+from compression import encode_body, is_compressible
+from models import User, Character, Episode, Location, character_favs, location_favs, episode_favs, foreign_key_column
+from pool import engine_options
+from serialization import dumps, msgpack, JSON_MIMETYPE
+from snapshot import catalog_snapshot
+from utils import APIException, content_etag, get_fields_arg, get_page_args, NDJSON_MIMETYPE
+
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+CATALOG_MODELS = {"characters": Character, "episodes": Episode, "locations": Location}
+FAVORITE_MODELS = {
+    "character": (Character, character_favs, "charactersFav"),
+    "location": (Location, location_favs, "locationsFav"),
+    "episode": (Episode, episode_favs, "episodesFav"),
+}
+# Anything else (filters, ?ids=, streams) keeps going through Flask
+PLAIN_ARGS = {"limit", "after", "fields"}
+
+CATALOG_LIST = re.compile(r"^/(characters|episodes|locations)/?$")
+CATALOG_DETAIL = re.compile(r"^/(characters|episodes|locations)/(\d+)/?$")
+USER_FAVORITES = re.compile(r"^/user/(\d+)/favorites(?:/(character|location|episode))?/?$")
+
+
+def async_database_uri(uri):
+    scheme, rest = uri.split("://", 1)
+    driver = ASYNC_DRIVERS.get(scheme.split("+")[0])
+    if driver is None:
+        raise RuntimeError("The async mode supports Postgres and SQLite, not " + scheme)
+    return driver + "://" + rest
+
+
+def create_engine_for(uri):
+    options = engine_options(uri)
+    # The async engine brings its own queue pool implementation
+    options.pop("poolclass", None)
+    return create_async_engine(async_database_uri(uri), **options)
+
+
+def json_body(obj):
+    return dumps(obj) + b"\n"
+
+
+class AsyncApp:
+    def __init__(self, wsgi_app, database_uri):
+        self.wsgi = WSGIMiddleware(wsgi_app)
+        self.engine = create_engine_for(database_uri)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        if scope["type"] == "http" and scope["method"] == "GET":
+            request = Request(scope, receive)
+            response = await self.dispatch(request)
+            if response is not None:
+                return await response(scope, receive, send)
+        return await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.engine.dispose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def dispatch(self, request):
+        path = request.url.path
+        accept = request.headers.get("accept", "")
+        if set(request.query_params) - PLAIN_ARGS or NDJSON_MIMETYPE in accept or "msgpack" in accept:
+            return None
+        try:
+            match = CATALOG_LIST.match(path)
+            if match:
+                return await self.cached(request, CATALOG_MODELS[match.group(1)], self.catalog_page)
+            match = CATALOG_DETAIL.match(path)
+            if match:
+                return await self.cached(request, CATALOG_MODELS[match.group(1)], self.catalog_detail, int(match.group(2)))
+            match = USER_FAVORITES.match(path)
+            if match:
+                body = await self.favorites(request, int(match.group(1)), match.group(2))
+                return self.respond(request, json_body(body))
+        except APIException as error:
+            return self.respond(request, json_body(error.to_dict()), error.status_code)
+        return None
+
+    async def cached(self, request, model, handler, *args):
+        # Same cache, keys and ETags as the Flask decorator in cache.py
+        if catalog_snapshot.table(model) is not None:
+            return None
+        key = request.url.path + "?" + request.url.query
+        entry = response_cache.get(key) if response_cache.max_entries else None
+        if entry is None:
+            version = shared_versions.stamp(model.__name__)
+            body = json_body(await handler(request, model, *args))
+            if response_cache.max_entries and model in CACHED_MODELS:
+                entry = response_cache.set(key, body, 200, JSON_MIMETYPE, model.__name__, version)
+            if entry is None:
+                return self.respond(request, body)
+        return self.respond(request, entry.body, etag=entry.etag, variants=entry.variants)
+
+    def respond(self, request, body, status_code=200, etag=None, variants=None):
+        headers = {}
+        # Same as serialization.vary_on_format: Flask answers these URLs with
+        # MessagePack when the Accept header asks for it
+        vary = ["Accept"] if msgpack is not None else []
+        if "origin" in request.headers:
+            headers["Access-Control-Allow-Origin"] = request.headers["origin"]
+            vary.append("Origin")
+        if status_code == 200:
+            etag = etag or content_etag(body)
+            if is_compressible(body):
+                vary.append("Accept-Encoding")
+                body, etag, encoding = encode_body(body, etag, request.headers.get("accept-encoding"), variants)
+                if encoding is not None:
+                    headers["Content-Encoding"] = encoding
+            headers["ETag"] = '"' + etag + '"'
+        if vary:
+            headers["Vary"] = ", ".join(vary)
+        if status_code == 200 and headers["ETag"] in request.headers.get("if-none-match", ""):
+            return Response(status_code=304, headers=headers)
+        return Response(body, status_code=status_code, media_type=JSON_MIMETYPE, headers=headers)
+
+    async def catalog_page(self, request, model):
+        fields = get_fields_arg(model, request.query_params)
+        limit, after = get_page_args(request.query_params)
+        statement = (select(*[getattr(model, x) for x in fields])
+                     .where(model.id > after).order_by(model.id).limit(limit + 1))
+        async with self.engine.connect() as connection:
+            rows = (await connection.execute(statement)).all()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = rows[-1].id
+        return {"body": [dict(zip(fields, x)) for x in rows], "next": next_cursor}
+
+    async def catalog_detail(self, request, model, object_id):
+        fields = get_fields_arg(model, request.query_params)
+        statement = select(*[getattr(model, x) for x in fields]).where(model.id == object_id)
+        async with self.engine.connect() as connection:
+            row = (await connection.execute(statement)).first()
+        if row is None:
+            return {"msg": "The user you are looking for doesn't exist."}
+        return {"Result": dict(zip(fields, row))}
+
+    async def favorites(self, request, user_id, kind):
+        kinds = [kind] if kind else list(FAVORITE_MODELS)
+        body = {}
+        async with self.engine.connect() as connection:
+            user = (await connection.execute(select(User.id).where(User.id == user_id))).first()
+            if user is None:
+                raise APIException("This user doesn't exist.", status_code=404)
+            for name in kinds:
+                model, association_table, key = FAVORITE_MODELS[name]
+                fields = get_fields_arg(model, request.query_params) if kind else list(model.serialize_fields)
+                foreign_key = foreign_key_column(association_table, model)
+                statement = (select(*[getattr(model, x) for x in fields])
+                             .join(association_table, foreign_key == model.id)
+                             .where(association_table.c.user_id == user_id)
+                             .order_by(model.id))
+                rows = (await connection.execute(statement)).all()
+                body[key] = [dict(zip(fields, x)) for x in rows]
+        return body
+
+
+app = AsyncApp(flask_app, flask_app.config['SQLALCHEMY_DATABASE_URI'])
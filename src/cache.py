@@ -0,0 +1,142 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import request, make_response, Response
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+from models import db, Character, Episode, Location
+from serialization import wants_msgpack, vary_on_format
+from utils import wants_stream, content_etag, make_conditional
+from versions import shared_versions
+from replicas import use_primary_if_changed
+
+CACHED_MODELS = (Character, Episode, Location)
+
+
+class CacheEntry:
+    def __init__(self, body, status_code, mimetype, tag, version, expires_at):
+        self.body = body
+        self.etag = content_etag(body)
+        self.status_code = status_code
+        self.mimetype = mimetype
+        self.tag = tag
+        # Shared version of the tag read before the body was built
+        self.version = version
+        self.expires_at = expires_at
+        # encoding -> compressed body, filled on first request for it. Not
+        # counted against max_bytes; it is a fraction of the body's size.
+        self.variants = {}
+
+
+class ResponseCache:
+    # Bounded LRU of serialized response bodies. Entries expire after `ttl`
+    # seconds and the least recently used ones are evicted once either
+    # `max_entries` or `max_bytes` is exceeded. An entry is also dropped once
+    # another process on the host bumped its tag (see versions.py).
+
+    def __init__(self, max_entries=512, max_bytes=32 * 1024 * 1024, ttl=300):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at <= time.monotonic() or entry.version != shared_versions.stamp(entry.tag):
+                self._pop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, body, status_code, mimetype, tag, version):
+        if len(body) > self.max_bytes:
+            return None
+        entry = CacheEntry(body, status_code, mimetype, tag, version, time.monotonic() + self.ttl)
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            self._entries[key] = entry
+            self._size += len(body)
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+        return entry
+
+    def invalidate(self, tag=None):
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if tag is None or e.tag == tag]:
+                self._pop(key)
+
+    def _pop(self, key):
+        entry = self._entries.pop(key)
+        self._size -= len(entry.body)
+
+
+response_cache = ResponseCache()
+
+
+def cache_key():
+    key = request.path + "?" + request.query_string.decode("latin-1")
+    return key + "|msgpack" if wants_msgpack() else key
+
+
+def cached_response(model):
+    tag = model.__name__
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # Streamed exports are never buffered into the cache
+            if wants_stream():
+                return view(*args, **kwargs)
+            if not response_cache.max_entries:
+                return make_conditional(make_response(view(*args, **kwargs)))
+            key = cache_key()
+            entry = response_cache.get(key)
+            if entry is not None:
+                response = vary_on_format(Response(entry.body, status=entry.status_code, mimetype=entry.mimetype))
+                return make_conditional(response, entry.etag, entry.variants)
+            version = shared_versions.stamp(tag)
+            use_primary_if_changed(tag)
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                entry = response_cache.set(key, response.get_data(), response.status_code, response.mimetype, tag, version)
+            if entry is None:
+                return make_conditional(response)
+            return make_conditional(response, entry.etag, entry.variants)
+        return wrapper
+    return decorator
+
+
+def _invalidate_model(mapper, connection, target):
+    tag = type(target).__name__
+    response_cache.invalidate(tag)
+    # Drop again once the transaction commits, in case a concurrent request
+    # re-cached the old rows between the flush and the commit.
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("invalidated_tags", set()).add(tag)
+
+
+def _invalidate_after_commit(session):
+    for tag in session.info.pop("invalidated_tags", ()):
+        response_cache.invalidate(tag)
+        # The other workers drop their entries on their next lookup
+        shared_versions.bump(tag)
+
+
+def setup_cache(app):
+    response_cache.max_entries = app.config.get('RESPONSE_CACHE_MAX_ENTRIES', 512)
+    response_cache.max_bytes = app.config.get('RESPONSE_CACHE_MAX_BYTES', 32 * 1024 * 1024)
+    response_cache.ttl = app.config.get('RESPONSE_CACHE_TTL', 300)
+    for model in CACHED_MODELS:
+        for event_name in ('after_insert', 'after_update', 'after_delete'):
+            if not event.contains(model, event_name, _invalidate_model):
+                event.listen(model, event_name, _invalidate_model)
+    if not event.contains(db.session, 'after_commit', _invalidate_after_commit):
+        event.listen(db.session, 'after_commit', _invalidate_after_commit)
@@ -0,0 +1,230 @@
+import csv
+import io
+import json
+import os
+import tempfile
+import time
+import click
+from flask.cli import AppGroup
+from sqlalchemy import Boolean, Integer, text
+from utils import upsert_statement
+from snapshot import write_snapshot
+from versions import shared_versions
+from models import db, Character, Episode, Location, episodes__characters, characters__locations
+
+# record type -> (table, conflict columns). Catalog rows are upserted on id so a
+# re-import updates them; link rows already present are left as they are.
+IMPORT_TABLES = {
+    "character": (Character.__table__, ["id"]),
+    "episode": (Episode.__table__, ["id"]),
+    "location": (Location.__table__, ["id"]),
+    "episode_character": (episodes__characters, ["episode_id", "character_id"]),
+    "character_location": (characters__locations, ["character_id", "location_id"]),
+}
+CATALOG_TYPES = ("character", "episode", "location")
+
+
+def read_records(file, file_format, record_type):
+    # Yields (type, dict) one at a time so a file of any size is never held in memory.
+    if file_format == "csv":
+        for row in csv.DictReader(file):
+            yield record_type, row
+        return
+    for line in file:
+        line = line.strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        yield record.pop("type", record_type), record
+
+
+def column_default(column):
+    default = column.default
+    if default is not None and default.is_scalar:
+        return default.arg
+    return None
+
+
+def coerce(table, record):
+    # Returns (values, supplied): every column of the table, the ones the
+    # record leaves out set to their default, and the names it did give.
+    # Rows of one executemany must all carry the same keys.
+    values = {}
+    supplied = []
+    for column in table.columns:
+        if column.name not in record:
+            values[column.name] = column_default(column)
+            continue
+        value = record[column.name]
+        if isinstance(value, str):
+            if isinstance(column.type, Boolean):
+                value = value.strip().lower() in ("1", "true", "yes")
+            elif isinstance(column.type, Integer):
+                value = int(value)
+        values[column.name] = value
+        supplied.append(column.name)
+    return values, tuple(supplied)
+
+
+def update_columns(table, supplied):
+    # A re-import only overwrites the columns the file gives, so a defaulted
+    # column left out of it keeps the value stored earlier.
+    return [c.name for c in table.columns if c.name in supplied and not c.primary_key]
+
+
+def copy_batch(table, index_elements, rows, updated):
+    # Postgres: COPY the batch into a temporary staging table, then upsert it
+    # into the real table with a single INSERT ... SELECT ... ON CONFLICT.
+    columns = [c.name for c in table.columns]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(["t" if v is True else "f" if v is False else v for v in (row[c] for c in columns)])
+    buffer.seek(0)
+    staging = "import_" + table.name
+    column_list = ", ".join('"%s"' % c for c in columns)
+    updates = ", ".join('"%s" = EXCLUDED."%s"' % (c, c) for c in updated)
+    conflict = ", ".join('"%s"' % c for c in index_elements)
+    connection = db.session.connection()
+    connection.execute(text('CREATE TEMP TABLE IF NOT EXISTS "%s" (LIKE "%s" INCLUDING DEFAULTS) ON COMMIT DROP' % (staging, table.name)))
+    connection.execute(text('TRUNCATE "%s"' % staging))
+    cursor = connection.connection.dbapi_connection.cursor()
+    try:
+        cursor.copy_expert('COPY "%s" (%s) FROM STDIN WITH CSV' % (staging, column_list), buffer)
+    finally:
+        cursor.close()
+    action = "DO UPDATE SET " + updates if updates else "DO NOTHING"
+    connection.execute(text('INSERT INTO "%s" (%s) SELECT %s FROM "%s" ON CONFLICT (%s) %s' % (
+        table.name, column_list, column_list, staging, conflict, action)))
+
+
+def write_batch(record_type, rows, use_copy):
+    # rows are (values, supplied); records giving different columns are
+    # upserted separately so each only updates its own columns.
+    table, index_elements = IMPORT_TABLES[record_type]
+    groups = {}
+    for values, supplied in rows:
+        groups.setdefault(supplied, []).append(values)
+    for supplied, group in groups.items():
+        updated = update_columns(table, supplied) if record_type in CATALOG_TYPES else []
+        if use_copy:
+            copy_batch(table, index_elements, group, updated)
+            continue
+        update = (lambda table, new: {c: getattr(new, c) for c in updated}) if updated else None
+        # A list of parameter sets makes SQLAlchemy use executemany
+        db.session.execute(upsert_statement(table, index_elements, update), group)
+
+
+def reset_sequences(dialect):
+    # Explicit ids leave Postgres' serial sequences behind; move them past
+    # the imported ids so rows created later through the admin don't collide.
+    if dialect != "postgresql":
+        return
+    for record_type in CATALOG_TYPES:
+        table = IMPORT_TABLES[record_type][0]
+        db.session.execute(text(
+            "SELECT setval(pg_get_serial_sequence('\"%s\"', 'id'), COALESCE(MAX(id), 1)) FROM \"%s\"" % (table.name, table.name)
+        ))
+
+
+def import_catalog(file, file_format, record_type=None, batch_size=1000, use_copy=False):
+    dialect = db.session.get_bind().dialect.name
+    use_copy = use_copy and dialect == "postgresql"
+    buffers = {x: [] for x in IMPORT_TABLES}
+    counts = {x: 0 for x in IMPORT_TABLES}
+
+    def add(kind, row):
+        buffers[kind].append(row)
+        if len(buffers[kind]) >= batch_size:
+            flush(kind)
+
+    def flush(kind):
+        if buffers[kind]:
+            write_batch(kind, buffers[kind], use_copy)
+            counts[kind] += len(buffers[kind])
+            buffers[kind] = []
+
+    # Link rows may come before the catalog rows they point to. They are
+    # spooled to a temporary file and written once every catalog row is in,
+    # so foreign keys are satisfied at every statement without deferring
+    # constraints (which Postgres only honours for DEFERRABLE ones).
+    with tempfile.TemporaryFile("w+", encoding="utf-8") as links:
+        try:
+            for kind, record in read_records(file, file_format, record_type):
+                if kind not in IMPORT_TABLES:
+                    raise click.BadParameter("Unknown record type: %r" % kind)
+                values, supplied = coerce(IMPORT_TABLES[kind][0], record)
+                if kind in CATALOG_TYPES:
+                    add(kind, (values, supplied))
+                else:
+                    links.write(json.dumps([kind, values, supplied]) + "\n")
+            for kind in CATALOG_TYPES:
+                flush(kind)
+            links.seek(0)
+            for line in links:
+                kind, values, supplied = json.loads(line)
+                add(kind, (values, tuple(supplied)))
+            for kind in IMPORT_TABLES:
+                flush(kind)
+            reset_sequences(dialect)
+            db.session.commit()
+            # Core inserts skip the ORM events; tell the running workers directly
+            for kind in CATALOG_TYPES:
+                if counts[kind]:
+                    shared_versions.bump(kind.capitalize())
+        except Exception:
+            db.session.rollback()
+            raise
+    return counts
+
+
+catalog_cli = AppGroup('catalog', help='Load and export the character/episode/location catalog.')
+
+
+@catalog_cli.command('import')
+@click.argument('file', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'file_format', type=click.Choice(['ndjson', 'csv']), default=None,
+              help='Input format, guessed from the file extension by default.')
+@click.option('--type', 'record_type', type=click.Choice(sorted(IMPORT_TABLES)), default=None,
+              help='Record type for CSV files or NDJSON lines without a "type" key.')
+@click.option('--batch-size', type=int, default=1000, show_default=True)
+@click.option('--copy/--no-copy', 'use_copy', default=True, show_default=True,
+              help='Use COPY into a staging table on Postgres.')
+def import_command(file, file_format, record_type, batch_size, use_copy):
+    """Upsert catalog rows and their links from an NDJSON or CSV file.
+
+    NDJSON lines carry a "type" (character, episode, location,
+    episode_character or character_location) plus the columns; re-running an
+    import updates rows in place instead of duplicating them.
+    """
+    if file_format is None:
+        file_format = "csv" if file.name.endswith(".csv") else "ndjson"
+    if file_format == "csv" and record_type is None:
+        raise click.UsageError("CSV imports need --type")
+    start = time.perf_counter()
+    counts = import_catalog(file, file_format, record_type, batch_size, use_copy)
+    elapsed = time.perf_counter() - start
+    total = sum(counts.values())
+    for kind, count in counts.items():
+        if count:
+            click.echo("  %-20s %d" % (kind, count))
+    click.echo("Imported %d rows in %.2fs (%.0f rows/s)" % (total, elapsed, total / elapsed if elapsed else 0))
+
+
+@catalog_cli.command('snapshot')
+@click.argument('path', type=click.Path(dir_okay=False, writable=True))
+def snapshot_command(path):
+    """Export characters, episodes and locations to a memory-mappable snapshot.
+
+    Point CATALOG_SNAPSHOT_PATH at the file and restart the workers to serve
+    catalog pages and id lookups from it.
+    """
+    start = time.perf_counter()
+    counts = write_snapshot(path)
+    for name, count in counts.items():
+        click.echo("  %-20s %d" % (name, count))
+    click.echo("Wrote %s (%d bytes) in %.2fs" % (path, os.path.getsize(path), time.perf_counter() - start))
+
+
+def setup_catalog(app):
+    app.cli.add_command(catalog_cli)
@@ -0,0 +1,54 @@
+import gzip
+from werkzeug.http import parse_accept_header
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this are sent as they are: the headers and the CPU cost
+# outweigh the bytes saved.
+COMPRESSION_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+ENCODERS = {"gzip": lambda body: gzip.compress(body, GZIP_LEVEL, mtime=0)}
+if brotli is not None:
+    ENCODERS["br"] = lambda body: brotli.compress(body, quality=BROTLI_QUALITY)
+
+# Server preference when the client accepts several with the same quality
+PREFERRED = [x for x in ("br", "gzip") if x in ENCODERS]
+
+
+def choose_encoding(accept_encoding):
+    if not accept_encoding:
+        return None
+    return parse_accept_header(accept_encoding).best_match(PREFERRED)
+
+
+def encode_body(body, etag, accept_encoding, variants=None):
+    # Returns (body, etag, encoding). Each encoding gets its own strong ETag.
+    # `variants` is a per-content-version dict (see cache.CacheEntry) that
+    # keeps compressed bodies so they are only computed once.
+    if not is_compressible(body):
+        return body, etag, None
+    encoding = choose_encoding(accept_encoding)
+    if encoding is None:
+        return body, etag, None
+    encoded = variants.get(encoding) if variants is not None else None
+    if encoded is None:
+        encoded = ENCODERS[encoding](body)
+        if variants is not None:
+            variants[encoding] = encoded
+    return encoded, etag + "-" + encoding, encoding
+
+
+def is_compressible(body):
+    return len(body) >= COMPRESSION_MIN_SIZE
+
+
+def setup_compression(app):
+    global COMPRESSION_MIN_SIZE, GZIP_LEVEL, BROTLI_QUALITY
+    COMPRESSION_MIN_SIZE = app.config.get('COMPRESSION_MIN_SIZE', COMPRESSION_MIN_SIZE)
+    GZIP_LEVEL = app.config.get('COMPRESSION_GZIP_LEVEL', GZIP_LEVEL)
+    BROTLI_QUALITY = app.config.get('COMPRESSION_BROTLI_QUALITY', BROTLI_QUALITY)
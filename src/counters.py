@@ -0,0 +1,78 @@
+import time
+import click
+from flask.cli import AppGroup
+from sqlalchemy import func
+from utils import upsert_statement
+from models import db, Character, Location, Episode, character_favs, location_favs, episode_favs, favorite_counts, foreign_key_column
+
+FAVORITE_TABLES = (
+    (Character, character_favs),
+    (Location, location_favs),
+    (Episode, episode_favs),
+)
+
+
+def adjust_favorite_counts(model, object_ids, delta):
+    # Runs in the caller's transaction, so the counters commit or roll back
+    # together with the favorite rows they describe.
+    object_ids = list(object_ids)
+    if not object_ids:
+        return
+    if delta < 0:
+        db.session.execute(
+            favorite_counts.update()
+            .where(favorite_counts.c.kind == model.__tablename__, favorite_counts.c.object_id.in_(object_ids))
+            .values(count=favorite_counts.c.count + delta)
+        )
+        return
+    db.session.execute(
+        upsert_statement(favorite_counts, ["kind", "object_id"],
+                         lambda table, new: {"count": table.c.count + new.count}),
+        [{"kind": model.__tablename__, "object_id": x, "count": delta} for x in object_ids],
+    )
+
+
+def release_user_favorite_counts(user_id):
+    for model, association_table in FAVORITE_TABLES:
+        foreign_key = foreign_key_column(association_table, model)
+        object_ids = db.session.execute(
+            db.select(foreign_key).where(association_table.c.user_id == user_id)
+        ).scalars().all()
+        adjust_favorite_counts(model, object_ids, -1)
+
+
+def top_favorites_query(model, limit):
+    # Served by ix_favorite_counts_kind_count; rows of deleted catalog
+    # entries drop out in the join.
+    columns = [getattr(model, x) for x in model.serialize_fields]
+    return (db.session.query(*columns, favorite_counts.c.count)
+            .join(favorite_counts, favorite_counts.c.object_id == model.id)
+            .filter(favorite_counts.c.kind == model.__tablename__, favorite_counts.c.count > 0)
+            .order_by(favorite_counts.c.count.desc(), model.id)
+            .limit(limit))
+
+
+def reconcile_favorite_counts():
+    db.session.execute(favorite_counts.delete())
+    for model, association_table in FAVORITE_TABLES:
+        foreign_key = foreign_key_column(association_table, model)
+        totals = (db.select(db.literal(model.__tablename__), foreign_key, func.count())
+                  .group_by(foreign_key))
+        db.session.execute(favorite_counts.insert().from_select(["kind", "object_id", "count"], totals))
+    db.session.commit()
+
+
+favorites_cli = AppGroup('favorites', help='Maintain the favorite counters.')
+
+
+@favorites_cli.command('reconcile')
+def reconcile_command():
+    """Rebuild favorite_counts from the *_favs association tables."""
+    start = time.perf_counter()
+    reconcile_favorite_counts()
+    rows = db.session.execute(db.select(func.count()).select_from(favorite_counts)).scalar()
+    click.echo("Rebuilt %d favorite counters in %.2fs" % (rows, time.perf_counter() - start))
+
+
+def setup_counters(app):
+    app.cli.add_command(favorites_cli)
@@ -0,0 +1,117 @@
+import heapq
+import logging
+import time
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from serialization import dumps
+
+logger = logging.getLogger("instrumentation")
+
+# Statements kept per request for the slow-request log line
+MAX_SLOWEST = 3
+MAX_STATEMENT_LENGTH = 300
+
+
+class QueryBudgetExceeded(AssertionError):
+    # Raised in strict mode so a test calling the endpoint fails loudly.
+    pass
+
+
+class RequestStats:
+    def __init__(self, budget=None, strict=False):
+        self.started_at = time.perf_counter()
+        self.budget = budget
+        self.strict = strict
+        self.queries = 0
+        self.db_seconds = 0.0
+        self._slowest = []
+
+    def record(self, statement, seconds):
+        self.queries += 1
+        self.db_seconds += seconds
+        item = (seconds, self.queries, statement)
+        if len(self._slowest) < MAX_SLOWEST:
+            heapq.heappush(self._slowest, item)
+        elif seconds > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, item)
+
+    def slowest(self):
+        return [{"ms": round(seconds * 1000, 3), "statement": " ".join(statement.split())[:MAX_STATEMENT_LENGTH]}
+                for seconds, _, statement in sorted(self._slowest, reverse=True)]
+
+
+def query_budget(limit):
+    # Maximum number of statements the decorated view may run per request
+    def decorator(view):
+        view.query_budget = limit
+        return view
+    return decorator
+
+
+def current_stats():
+    if has_request_context():
+        return g.get("request_stats")
+    return None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current_stats()
+    # Raised before the statement runs, inside the view, so the transaction
+    # is rolled back instead of committing a write the client sees fail.
+    if stats is not None and stats.strict and stats.budget is not None and stats.queries >= stats.budget:
+        raise QueryBudgetExceeded("%s ran more than %d queries" % (request.endpoint, stats.budget))
+    conn.info["query_started_at"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop("query_started_at", None)
+    stats = current_stats()
+    if stats is not None and started is not None:
+        stats.record(statement, time.perf_counter() - started)
+
+
+def _start_request(app):
+    view = app.view_functions.get(request.endpoint)
+    g.request_stats = RequestStats(getattr(view, "query_budget", None), app.config.get('QUERY_BUDGET_STRICT'))
+
+
+def _finish_request(app, response):
+    stats = g.get("request_stats")
+    if stats is None:
+        return response
+    # Streamed bodies run their queries after this hook; only the part before
+    # the first chunk is counted for them.
+    total_ms = (time.perf_counter() - stats.started_at) * 1000
+    db_ms = stats.db_seconds * 1000
+    if app.config.get('SERVER_TIMING'):
+        response.headers.add("Server-Timing", 'db;dur=%.3f;desc="%d queries"' % (db_ms, stats.queries))
+        response.headers.add("Server-Timing", "app;dur=%.3f" % total_ms)
+
+    budget = stats.budget
+    over_budget = budget is not None and stats.queries > budget
+    threshold = app.config.get('SLOW_REQUEST_MS')
+    if over_budget or (threshold is not None and total_ms >= threshold):
+        logger.warning(dumps({
+            "event": "query_budget_exceeded" if over_budget else "slow_request",
+            "method": request.method,
+            "path": request.full_path.rstrip("?"),
+            "endpoint": request.endpoint,
+            "status": response.status_code,
+            "duration_ms": round(total_ms, 3),
+            "db_ms": round(db_ms, 3),
+            "queries": stats.queries,
+            "query_budget": budget,
+            "slowest": stats.slowest(),
+        }).decode())
+    return response
+
+
+def setup_instrumentation(app):
+    # Listening on the Engine class also covers the read replica engines
+    engine = Engine
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    app.before_request(lambda: _start_request(app))
+    app.after_request(lambda response: _finish_request(app, response))
@@ -0,0 +1,74 @@
+import os
+import time
+from flask import request, Response
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client import multiprocess
+from sqlalchemy import event
+from instrumentation import current_stats
+from models import db
+from pool import pool_stats
+
+# With PROMETHEUS_MULTIPROC_DIR set, every gunicorn worker writes its samples
+# to mmap'd files in that directory and /metrics merges them, so any worker
+# can answer a scrape. The directory must be emptied before the server starts
+# (see gunicorn.conf.py).
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+SIZE_BUCKETS = (128, 512, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+DB_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5)
+
+REQUESTS = Counter("http_requests_total", "HTTP requests handled.", ["method", "route", "status"])
+LATENCY = Histogram("http_request_duration_seconds", "Time spent handling the request.", ["method", "route"])
+RESPONSE_SIZE = Histogram("http_response_size_bytes", "Size of non-streamed response bodies.", ["method", "route"],
+                          buckets=SIZE_BUCKETS)
+DB_TIME = Histogram("db_request_duration_seconds", "Time spent in the database per request.", ["method", "route"],
+                    buckets=DB_BUCKETS)
+DB_QUERIES = Counter("db_queries_total", "Statements sent to the database.", ["method", "route"])
+
+# Pool gauges are summed over the live workers
+POOL_CHECKED_OUT = Gauge("db_pool_checked_out", "Connections currently checked out.", multiprocess_mode="livesum")
+POOL_CONNECTS = Gauge("db_pool_connects", "Connections opened by the pool since the worker started.",
+                      multiprocess_mode="livesum")
+POOL_WAIT_SECONDS = Gauge("db_pool_wait_seconds", "Time spent waiting for a pool connection since the worker started.",
+                          multiprocess_mode="livesum")
+
+
+def _record(response):
+    stats = current_stats()
+    if stats is None or request.endpoint == "metrics":
+        return response
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    method = request.method
+    REQUESTS.labels(method, route, str(response.status_code)).inc()
+    LATENCY.labels(method, route).observe(time.perf_counter() - stats.started_at)
+    if not response.is_streamed:
+        RESPONSE_SIZE.labels(method, route).observe(response.calculate_content_length() or 0)
+    DB_TIME.labels(method, route).observe(stats.db_seconds)
+    DB_QUERIES.labels(method, route).inc(stats.queries)
+    return response
+
+
+def _update_pool_gauges(*args):
+    # Runs after the pool.py listeners, so pool_stats is already up to date
+    POOL_CHECKED_OUT.set(pool_stats.checked_out)
+    POOL_CONNECTS.set(pool_stats.connects)
+    POOL_WAIT_SECONDS.set(pool_stats.wait_seconds)
+
+
+def get_metrics():
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+def setup_metrics(app):
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "checkout", _update_pool_gauges)
+    event.listen(engine, "checkin", _update_pool_gauges)
+    # Reads the per-request stats collected by instrumentation.py
+    app.after_request(_record)
+    app.add_url_rule('/metrics', 'metrics', get_metrics, methods=['GET'])
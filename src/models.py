@@ -1,6 +1,7 @@
 from flask_sqlalchemy import SQLAlchemy
+from replicas import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -10,9 +11,12 @@ class User(db.Model):
     email = db.Column(db.String(120), unique=True, nullable=False)
     password = db.Column(db.String(80), unique=False, nullable=False)
     is_active = db.Column(db.Boolean(), unique=False, nullable=False, default=True)
-    charactersFav = db.relationship("Character", secondary="character_favs", lazy='subquery', backref=db.backref('users', lazy=True))
-    locationsFav = db.relationship("Location", secondary="location_favs", lazy='subquery', backref=db.backref('users', lazy=True))
-    episodesFav = db.relationship("Episode", secondary="episode_favs",lazy='subquery', backref=db.backref('users', lazy=True))
+    charactersFav = db.relationship("Character", secondary="character_favs", lazy=True, backref=db.backref('users', lazy=True))
+    locationsFav = db.relationship("Location", secondary="location_favs", lazy=True, backref=db.backref('users', lazy=True))
+    episodesFav = db.relationship("Episode", secondary="episode_favs",lazy=True, backref=db.backref('users', lazy=True))
+
+    # keys produced by serialize(), the only columns clients may select with ?fields=
+    serialize_fields = ("id", "username", "first_name", "last_name", "email", "is_active")
     
     def serialize(self):
         return {
@@ -30,10 +34,15 @@ class User(db.Model):
 
 class Character(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    character_name = db.Column(db.String(120), nullable=False)
-    gender = db.Column(db.String(80), unique=False, nullable=False)
-    alive = db.Column(db.Boolean(), unique=False, nullable=False, default=True)
-    species = db.Column(db.String(250),unique=False, nullable=False)
+    character_name = db.Column(db.String(120), nullable=False, index=True)
+    gender = db.Column(db.String(80), unique=False, nullable=False, index=True)
+    alive = db.Column(db.Boolean(), unique=False, nullable=False, default=True, index=True)
+    species = db.Column(db.String(250),unique=False, nullable=False, index=True)
+
+    serialize_fields = ("id", "character_name", "gender", "alive", "species")
+    # columns clients may filter on with ?column=value, and the one ?name= searches
+    filter_fields = ("species", "gender", "alive")
+    search_field = "character_name"
 
     def serialize(self):
         return {
@@ -52,8 +61,13 @@ character_favs = db.Table('character_favs',
 class Location(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     location_name = db.Column(db.String(120), unique=True, nullable=False)
-    location_type = db.Column(db.String(250), unique=False, nullable=False)
-    dimension = db.Column(db.String(250), unique=False, nullable=False)
+    location_type = db.Column(db.String(250), unique=False, nullable=False, index=True)
+    dimension = db.Column(db.String(250), unique=False, nullable=False, index=True)
+    residents = db.relationship("Character", secondary="characters__locations", lazy=True, backref=db.backref('locations', lazy=True))
+
+    serialize_fields = ("id", "location_name", "location_type", "dimension")
+    filter_fields = ("location_type", "dimension")
+    search_field = "location_name"
 
     def serialize(self):
         return {
@@ -73,6 +87,11 @@ class Episode(db.Model):
     episode_name = db.Column(db.String(120), unique=True, nullable=False)
     air_date = db.Column(db.String(250), unique=False, nullable=False)
     episode = db.Column(db.String(120), unique=True, nullable=False)
+    characters = db.relationship("Character", secondary="episodes__characters", lazy=True, backref=db.backref('episodes', lazy=True))
+
+    serialize_fields = ("id", "episode_name", "air_date", "episode")
+    filter_fields = ()
+    search_field = "episode_name"
 
     def serialize(self):
         return {
@@ -86,3 +105,29 @@ episode_favs = db.Table('episode_favs',
     db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
     db.Column('episode_id', db.Integer, db.ForeignKey('episode.id'), primary_key=True)
 )
+
+def foreign_key_column(association_table, model):
+    # The column of a *_favs or link table that points at `model`
+    return getattr(association_table.c, model.__tablename__ + "_id")
+
+# The leading primary key column serves lookups from that side; the second
+# column gets its own index for the reverse direction.
+episodes__characters = db.Table('episodes__characters',
+    db.Column('episode_id', db.Integer, db.ForeignKey('episode.id'), primary_key=True),
+    db.Column('character_id', db.Integer, db.ForeignKey('character.id'), primary_key=True, index=True)
+)
+
+characters__locations = db.Table('characters__locations',
+    db.Column('character_id', db.Integer, db.ForeignKey('character.id'), primary_key=True),
+    db.Column('location_id', db.Integer, db.ForeignKey('location.id'), primary_key=True, index=True)
+)
+
+# Number of users that favorited each character/location/episode, keyed by the
+# model's table name. Kept in step by the favorite handlers in app.py and
+# rebuilt from the *_favs tables with `flask favorites reconcile`.
+favorite_counts = db.Table('favorite_counts',
+    db.Column('kind', db.String(20), primary_key=True),
+    db.Column('object_id', db.Integer, primary_key=True),
+    db.Column('count', db.Integer, nullable=False, default=0),
+    db.Index('ix_favorite_counts_kind_count', 'kind', 'count')
+)
@@ -0,0 +1,122 @@
+import os
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+from models import db
+
+
+class PoolStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.connects = 0
+            self.checkouts = 0
+            self.checked_out = 0
+            self.wait_count = 0
+            self.wait_seconds = 0.0
+            self.max_wait_seconds = 0.0
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self.wait_count += 1
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "checked_out": self.checked_out,
+                "wait_count": self.wait_count,
+                "wait_us_total": round(self.wait_seconds * 1e6),
+                "wait_us_max": round(self.max_wait_seconds * 1e6),
+            }
+
+
+pool_stats = PoolStats()
+
+
+class TimedQueuePool(QueuePool):
+    # QueuePool that records checkouts which found the pool exhausted (every
+    # connection in use, overflow included) and how long they blocked on
+    # pool_timeout. Checkouts served straight away are not waits.
+
+    def _is_exhausted(self):
+        return self._max_overflow > -1 and self.checkedout() >= self.size() + self._max_overflow
+
+    def _do_get(self):
+        if not self._is_exhausted():
+            return super()._do_get()
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_stats.record_wait(time.perf_counter() - start)
+
+
+def engine_options(database_uri):
+    options = {
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "1") == "1",
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", 1800)),
+    }
+    # SQLite uses its own single-file/in-memory pools; sizing only applies to servers
+    if not database_uri.startswith("sqlite"):
+        options.update({
+            "poolclass": TimedQueuePool,
+            "pool_size": int(os.getenv("DB_POOL_SIZE", 5)),
+            "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 10)),
+            "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", 30)),
+        })
+    return options
+
+
+def _on_connect(dbapi_connection, connection_record):
+    pool_stats.incr("connects")
+
+
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    pool_stats.incr("checkouts")
+    pool_stats.incr("checked_out")
+
+
+def _on_checkin(dbapi_connection, connection_record):
+    pool_stats.incr("checked_out", -1)
+
+
+def get_pool_status():
+    status = pool_stats.to_dict()
+    pool = db.engine.pool
+    if isinstance(pool, QueuePool):
+        status.update({
+            "pool_size": pool.size(),
+            "pool_checked_in": pool.checkedin(),
+            "pool_overflow": pool.overflow(),
+        })
+    return status
+
+
+def setup_pool(app):
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "connect", _on_connect)
+    event.listen(engine, "checkout", _on_checkout)
+    event.listen(engine, "checkin", _on_checkin)
+
+    def reset_after_fork():
+        # Connections opened before a fork (e.g. gunicorn --preload) belong to
+        # the parent. Each worker starts its own pool and leaves those alone.
+        engine.dispose(close=False)
+        pool_stats.reset()
+
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=reset_after_fork)
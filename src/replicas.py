@@ -0,0 +1,163 @@
+import itertools
+import os
+import threading
+import time
+from flask import g, request, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import DBAPIError, OperationalError
+from versions import shared_versions
+
+# Set on the client after it changes its favorites, so its next reads go to
+# the primary even when they land on another worker.
+STICKY_COOKIE = "primary_until"
+READ_METHODS = ("GET", "HEAD")
+
+
+class Replica:
+    def __init__(self, url, options):
+        self.url = url
+        self.engine = create_engine(url, **options)
+        self.ejected_until = 0.0
+
+    def is_healthy(self):
+        return self.ejected_until <= time.monotonic()
+
+
+class ReplicaSet:
+    # Round-robin over the healthy replicas. A replica whose connection fails
+    # is ejected for `eject_seconds` and then tried again by the next request.
+
+    def __init__(self):
+        self.replicas = []
+        self.eject_seconds = 30
+        self.sticky_seconds = 5
+        self._counter = itertools.count()
+        self._sticky = {}
+        self._lock = threading.Lock()
+
+    def choose(self):
+        start = next(self._counter)
+        for i in range(len(self.replicas)):
+            replica = self.replicas[(start + i) % len(self.replicas)]
+            if replica.is_healthy():
+                return replica
+        return None
+
+    def eject(self, engine):
+        for replica in self.replicas:
+            if replica.engine is engine:
+                replica.ejected_until = time.monotonic() + self.eject_seconds
+
+    def stick(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._sticky) > 10000:
+                self._sticky = {k: v for k, v in self._sticky.items() if v > now}
+            self._sticky[user_id] = now + self.sticky_seconds
+
+    def is_sticky(self, user_id):
+        until = self._sticky.get(user_id)
+        return until is not None and until > time.monotonic()
+
+    def status(self):
+        return [{"url": x.engine.url.render_as_string(hide_password=True), "healthy": x.is_healthy()}
+                for x in self.replicas]
+
+
+replica_set = ReplicaSet()
+
+
+def stick_to_primary(user_id):
+    # Call after committing a change to the user's favorites
+    if replica_set.replicas:
+        replica_set.stick(user_id)
+        g.stick_to_primary = True
+
+
+def use_primary():
+    # The rest of this request reads from the primary
+    if replica_set.replicas and has_request_context():
+        g.replica = None
+
+
+def use_primary_if_changed(tag):
+    # Right after a commit changed `tag` a lagging replica may still return
+    # the old rows, and whatever is read now gets cached (response cache,
+    # search index) well past the lag.
+    age = shared_versions.age(tag)
+    if age is not None and age < replica_set.sticky_seconds:
+        use_primary()
+
+
+def replica_for_request():
+    if not replica_set.replicas or not has_request_context() or request.method not in READ_METHODS:
+        return None
+    if "replica" not in g:
+        g.replica = None
+        user_id = (request.view_args or {}).get("user_id")
+        sticky_until = request.cookies.get(STICKY_COOKIE, "")
+        sticky = sticky_until.isdigit() and int(sticky_until) > time.time()
+        if not sticky and (user_id is None or not replica_set.is_sticky(user_id)):
+            g.replica = replica_set.choose()
+    return g.replica
+
+
+class RoutingSession(Session):
+    # Reads made while handling a GET go to a replica, everything else
+    # (writes, flushes, CLI commands, startup) to the primary.
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing:
+            replica = replica_for_request()
+            if replica is not None:
+                return replica.engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _eject_on_error(context):
+    if context.is_disconnect or isinstance(context.sqlalchemy_exception, OperationalError):
+        replica_set.eject(context.engine)
+
+
+def _dispatch_with_fallback(dispatch, session):
+    # A replica that fails mid-request was ejected by _eject_on_error; the
+    # request is run once more, on the primary, instead of answering 500.
+    def dispatch_request():
+        try:
+            return dispatch()
+        except DBAPIError:
+            replica = g.get("replica")
+            if replica is None or replica.is_healthy():
+                raise
+            session.rollback()
+            g.replica = None
+            return dispatch()
+    return dispatch_request
+
+
+def _set_sticky_cookie(response):
+    if g.get("stick_to_primary"):
+        until = int(time.time()) + replica_set.sticky_seconds
+        response.set_cookie(STICKY_COOKIE, str(until), max_age=replica_set.sticky_seconds, httponly=True)
+    return response
+
+
+def setup_replicas(app):
+    urls = [x.strip() for x in app.config.get('DATABASE_REPLICA_URLS', "").split(",") if x.strip()]
+    replica_set.eject_seconds = app.config.get('REPLICA_EJECT_SECONDS', 30)
+    replica_set.sticky_seconds = app.config.get('REPLICA_STICKY_SECONDS', 5)
+    replica_set.replicas = [Replica(x, app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})) for x in urls]
+    for replica in replica_set.replicas:
+        event.listen(replica.engine, "handle_error", _eject_on_error)
+    app.after_request(_set_sticky_cookie)
+    if replica_set.replicas:
+        # models.py imports this module, so the session comes from the extension
+        app.dispatch_request = _dispatch_with_fallback(app.dispatch_request, app.extensions["sqlalchemy"].session)
+
+    def reset_after_fork():
+        for replica in replica_set.replicas:
+            replica.engine.dispose(close=False)
+
+    if replica_set.replicas and hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=reset_after_fork)
@@ -0,0 +1,346 @@
+import heapq
+import re
+import threading
+import time
+from array import array
+from collections import OrderedDict, defaultdict
+from sqlalchemy import event
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import object_session
+from models import db, Character, Episode, Location
+from versions import shared_versions
+from replicas import use_primary
+
+# model -> (result type, columns that are indexed, column shown as the result name)
+SEARCH_MODELS = {
+    Character: ("character", ("character_name", "species"), "character_name"),
+    Episode: ("episode", ("episode_name", "episode"), "episode_name"),
+    Location: ("location", ("location_name", "dimension"), "location_name"),
+}
+
+# A document matches when its words cover at least this share of the query
+MIN_SCORE = 0.5
+MAX_RESULTS = 50
+# Words of up to this many characters are looked up as exact prefixes only
+PREFIX_LENGTH = 2
+MAX_CACHED_QUERIES = 1024
+
+_word_re = re.compile(r"[^\w]+")
+
+
+def words(text):
+    return [x for x in _word_re.split(text.lower()) if x]
+
+
+def trigrams(word, complete=True):
+    # Padded at the front so the first letters typed form grams of their own.
+    # Query words are not padded at the end: the user may still be typing.
+    padded = "  " + word + (" " if complete else "")
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def allowed_typos(word):
+    # Numbers and codes like "S01E03" must match as typed
+    if len(word) <= PREFIX_LENGTH or not word.isalpha():
+        return 0
+    return 1 if len(word) < 8 else 2
+
+
+def edit_distances(a, b, limit):
+    # Optimal string alignment distance of `a` to every prefix of `b`:
+    # insertions, deletions, substitutions and transpositions of two adjacent
+    # letters ("mroty") each cost 1. Only cells within `limit` of the
+    # diagonal are computed; returns None once every one is over `limit`.
+    over = limit + 1
+    before, previous = None, [j if j <= limit else over for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        current = [i if i <= limit else over] + [over] * len(b)
+        for j in range(max(1, i - limit), min(len(b), i + limit) + 1):
+            cost = a[i - 1] != b[j - 1]
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                value = min(value, before[j - 2] + 1)
+            current[j] = min(value, over)
+        if min(current) > limit:
+            return None
+        before, previous = previous, current
+    return previous
+
+
+def word_score(query_word, word):
+    # 1.0 for the same word. A prefix of the word scores by how much of it was
+    # typed, and each typo takes its share of the query word off.
+    typos = allowed_typos(query_word)
+    if word.startswith(query_word):
+        distance, completeness = 0, len(query_word) / len(word)
+    elif not typos or len(word) < len(query_word) - typos:
+        return 0.0
+    else:
+        row = edit_distances(query_word, word, typos)
+        if row is None:
+            return 0.0
+        # Distance to the whole word, else to the closest prefix of it
+        distance, completeness = row[-1], 1.0
+        prefix = min(range(len(row)), key=lambda j: (row[j], -j))
+        if row[prefix] < distance:
+            distance, completeness = row[prefix], prefix / len(word)
+        if distance > typos:
+            return 0.0
+    return (1 - distance / len(query_word)) * (0.6 + 0.4 * completeness)
+
+
+class SearchIndex:
+    # Inverted index over the words of every document. Trigrams and short
+    # prefixes point to word numbers, each word to a compact array of the
+    # documents containing it. A document scores the mean, over the query
+    # words, of its best matching word, so each word typed (even partly or
+    # with a typo) counts on its own. Removed or replaced documents are
+    # tombstoned and the index is rebuilt from the live documents once
+    # tombstones make up a quarter of it.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.built = False
+        self.built_at = 0.0
+        # Shared version of each model the index was built from (versions.py)
+        self.versions = {}
+        self.max_age = 300
+        self._clear()
+
+    def _clear(self):
+        self._words = []
+        self._word_numbers = {}
+        self._word_docs = []
+        self._grams = defaultdict(lambda: array("I"))
+        self._prefixes = defaultdict(lambda: array("I"))
+        self._docs = []
+        self._doc_numbers = {}
+        self._removed = set()
+        self._matches = OrderedDict()
+
+    def build(self, documents, versions=None):
+        with self._lock:
+            self._clear()
+            for key, name, text in documents:
+                self._add(key, name, words(text))
+            self.versions = dict(versions or {})
+            self.built_at = time.monotonic()
+            self.built = True
+
+    def add(self, key, name, text):
+        with self._lock:
+            self._remove(key)
+            self._add(key, name, words(text))
+
+    def remove(self, key):
+        with self._lock:
+            self._remove(key)
+            if len(self._removed) * 4 > len(self._docs):
+                self._compact()
+
+    def _word_number(self, word):
+        number = self._word_numbers.get(word)
+        if number is None:
+            number = len(self._words)
+            self._words.append(word)
+            self._word_numbers[word] = number
+            self._word_docs.append(array("I"))
+            for gram in trigrams(word):
+                self._grams[gram].append(number)
+            for length in range(1, PREFIX_LENGTH + 1):
+                self._prefixes[word[:length]].append(number)
+        return number
+
+    def _add(self, key, name, doc_words):
+        number = len(self._docs)
+        self._docs.append((key, name, doc_words))
+        self._doc_numbers[key] = number
+        for word in set(doc_words):
+            self._word_docs[self._word_number(word)].append(number)
+
+    def _remove(self, key):
+        number = self._doc_numbers.pop(key, None)
+        if number is not None:
+            self._removed.add(number)
+
+    def _compact(self):
+        docs = [x for number, x in enumerate(self._docs) if number not in self._removed]
+        self._clear()
+        for key, name, doc_words in docs:
+            self._add(key, name, doc_words)
+
+    def _candidate_words(self, query_word):
+        if len(query_word) <= PREFIX_LENGTH:
+            return self._prefixes.get(query_word, ())
+        typos = allowed_typos(query_word)
+        # A typo changes at most three of the query's grams, except swapping
+        # the first letters, which changes four: swapped variants cover that.
+        variants = {query_word} | {query_word[:i] + query_word[i + 1] + query_word[i] + query_word[i + 2:]
+                                   for i in range(len(query_word) - 1)}
+        candidates = set()
+        for variant in variants:
+            grams = trigrams(variant, complete=False)
+            needed = max(1, len(grams) - 3 * typos)
+            common = defaultdict(int)
+            for gram in grams:
+                for number in self._grams.get(gram, ()):
+                    common[number] += 1
+            candidates.update(number for number, count in common.items() if count >= needed)
+        return candidates
+
+    def _matching_words(self, query_word):
+        # (word number, score) of every word the query word matches, best
+        # first. Kept for recent query words, since autocomplete sends the
+        # same prefixes over and over, until words are added to the vocabulary.
+        cached = self._matches.get(query_word)
+        if cached is not None and cached[0] == len(self._words):
+            self._matches.move_to_end(query_word)
+            return cached[1]
+        matches = []
+        for number in self._candidate_words(query_word):
+            score = word_score(query_word, self._words[number])
+            if score:
+                matches.append((number, score))
+        matches.sort(key=lambda x: -x[1])
+        self._matches[query_word] = (len(self._words), matches)
+        if len(self._matches) > MAX_CACHED_QUERIES:
+            self._matches.popitem(last=False)
+        return matches
+
+    def search(self, query, limit=10, kind=None):
+        query_words = list(dict.fromkeys(words(query)))
+        if not query_words:
+            return []
+        with self._lock:
+            totals = defaultdict(float)
+            single = len(query_words) == 1
+            for query_word in query_words:
+                best = {}
+                found, floor = 0, None
+                # Best words first, so a document keeps the score of the first
+                # of its words seen. With a single query word that is its final
+                # score: once `limit` documents are in, lower words can't place.
+                for number, score in self._matching_words(query_word):
+                    if single and (score < MIN_SCORE or (floor is not None and score < floor)):
+                        break
+                    for doc in self._word_docs[number]:
+                        if doc in best:
+                            continue
+                        best[doc] = score
+                        if single and doc not in self._removed and (kind is None or self._docs[doc][0][0] == kind):
+                            found += 1
+                    if single and floor is None and found >= limit:
+                        floor = score
+                for doc, score in best.items():
+                    totals[doc] += score
+            results = []
+            for number, total in totals.items():
+                if number in self._removed:
+                    continue
+                key, name, doc_words = self._docs[number]
+                if kind is not None and key[0] != kind:
+                    continue
+                score = total / len(query_words)
+                if score >= MIN_SCORE:
+                    # Among equal scores, documents with fewer words match closer
+                    results.append((score, -len(doc_words), -key[1], key, name))
+        best = heapq.nlargest(limit, results)
+        return [{"type": key[0], "id": key[1], "name": name, "score": round(score, 3)}
+                for score, _, _, key, name in best]
+
+    def is_stale(self):
+        if self.max_age and time.monotonic() - self.built_at > self.max_age:
+            return True
+        for tag, version in self.versions.items():
+            current = shared_versions.stamp(tag)
+            if current == version:
+                continue
+            if current != shared_versions.written.get(tag):
+                return True
+            # Our own commit: its changes were applied incrementally
+            self.versions[tag] = current
+        return False
+
+
+search_index = SearchIndex()
+_build_lock = threading.Lock()
+
+
+def _document(model, values):
+    kind, columns, name_column = SEARCH_MODELS[model]
+    text = " ".join(str(values[x]) for x in columns if values[x] is not None)
+    return (kind, values["id"]), values[name_column], text
+
+
+def build_search_index():
+    # Versions are read first: a commit made during the build leaves them
+    # changed, and the next search rebuilds again.
+    versions = {model.__name__: shared_versions.stamp(model.__name__) for model in SEARCH_MODELS}
+    documents = []
+    for model, (_, columns, _) in SEARCH_MODELS.items():
+        fields = ("id",) + columns
+        for row in db.session.query(*[getattr(model, x) for x in fields]).yield_per(1000):
+            documents.append(_document(model, dict(zip(fields, row))))
+    search_index.build(documents, versions)
+
+
+def ensure_search_index():
+    # Rebuilt when another worker committed catalog changes, or after
+    # SEARCH_INDEX_MAX_AGE seconds in case a change slipped past the versions.
+    # While one thread rebuilds, the others keep searching the old index.
+    if search_index.built and not search_index.is_stale():
+        return
+    if not _build_lock.acquire(blocking=not search_index.built):
+        return
+    try:
+        # Not from a replica that may not have the change that made it stale
+        use_primary()
+        build_search_index()
+    finally:
+        _build_lock.release()
+
+
+def _record_change(mapper, connection, target, deleted=False):
+    model = type(target)
+    _, columns, _ = SEARCH_MODELS[model]
+    values = {x: getattr(target, x) for x in ("id",) + columns}
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("search_changes", []).append((model, values, deleted))
+
+
+def _record_delete(mapper, connection, target):
+    _record_change(mapper, connection, target, deleted=True)
+
+
+def _apply_after_commit(session):
+    # Index only what was committed; rolled back flushes are discarded below.
+    for model, values, deleted in session.info.pop("search_changes", ()):
+        key, name, text = _document(model, values)
+        if deleted:
+            search_index.remove(key)
+        else:
+            search_index.add(key, name, text)
+
+
+def _discard_after_rollback(session):
+    session.info.pop("search_changes", None)
+
+
+def setup_search(app):
+    search_index.max_age = app.config.get('SEARCH_INDEX_MAX_AGE', 300)
+    for model in SEARCH_MODELS:
+        for event_name in ('after_insert', 'after_update'):
+            if not event.contains(model, event_name, _record_change):
+                event.listen(model, event_name, _record_change)
+        if not event.contains(model, 'after_delete', _record_delete):
+            event.listen(model, 'after_delete', _record_delete)
+    if not event.contains(db.session, 'after_commit', _apply_after_commit):
+        event.listen(db.session, 'after_commit', _apply_after_commit)
+        event.listen(db.session, 'after_rollback', _discard_after_rollback)
+    with app.app_context():
+        try:
+            build_search_index()
+        except SQLAlchemyError:
+            # Tables not created/migrated yet; the first /search builds it.
+            db.session.rollback()
@@ -0,0 +1,86 @@
+import json
+import os
+from flask import Response, request, has_request_context
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_MIMETYPE = "application/json"
+MSGPACK_MIMETYPE = "application/msgpack"
+MSGPACK_MIMETYPES = (MSGPACK_MIMETYPE, "application/x-msgpack")
+
+# "auto" picks orjson when it is installed, "stdlib" forces the json module.
+# Both backends produce the same bytes: sorted keys, compact separators and
+# UTF-8 output without \u escapes for non-ASCII text. Floats only match
+# between 1e-4 and 1e16: outside it the stdlib writes 1e-06 where orjson
+# writes 1e-6, and NaN/Infinity where orjson writes null. Payloads keep
+# to that range; durations too small for it are sent as integer microseconds.
+JSON_BACKEND = os.getenv("JSON_BACKEND", "auto")
+
+
+def _stdlib_dumps(obj):
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def _orjson_dumps(obj):
+    return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+
+
+BACKENDS = {"stdlib": _stdlib_dumps}
+if orjson is not None:
+    BACKENDS["orjson"] = _orjson_dumps
+
+_backend = _stdlib_dumps
+
+
+def set_backend(name):
+    global _backend
+    if name == "auto":
+        name = "orjson" if "orjson" in BACKENDS else "stdlib"
+    if name not in BACKENDS:
+        raise ValueError("Unknown or unavailable JSON backend: " + name)
+    _backend = BACKENDS[name]
+    return name
+
+
+def dumps(obj):
+    return _backend(obj)
+
+
+def wants_msgpack():
+    # Only when the client ranks MessagePack above JSON; */* still gets JSON
+    if msgpack is None or not has_request_context():
+        return False
+    return request.accept_mimetypes.best_match((JSON_MIMETYPE,) + MSGPACK_MIMETYPES) in MSGPACK_MIMETYPES
+
+
+def vary_on_format(response):
+    if msgpack is not None:
+        response.vary.add("Accept")
+    return response
+
+
+def json_response(obj, status=200):
+    # JSON, or MessagePack of the same structure when the Accept header asks for it
+    if wants_msgpack():
+        response = Response(msgpack.packb(obj), status=status, mimetype=MSGPACK_MIMETYPE)
+    else:
+        response = Response(dumps(obj) + b"\n", status=status, mimetype=JSON_MIMETYPE)
+    return vary_on_format(response)
+
+
+def row_serializer(fields):
+    # Rows from a column select are plain tuples in `fields` order.
+    def serialize(row):
+        return dict(zip(fields, row))
+    return serialize
+
+
+set_backend(JSON_BACKEND)
@@ -0,0 +1,190 @@
+import json
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_right
+from flask import request
+from sqlalchemy import Boolean, Integer
+from models import db, Character, Episode, Location
+from serialization import json_response
+from versions import shared_versions
+from utils import get_fields_arg, get_page_args, wants_stream
+
+# File layout, all little-endian and 8-byte aligned:
+#   b"RMSNAP01" | u32 header length | JSON header | column arrays | string table
+# Integer columns are int32 arrays, booleans uint8 arrays and strings uint32
+# indexes into a shared, de-duplicated string table (uint32 offsets + UTF-8
+# blob). Rows are sorted by id, so the id column doubles as the id -> row
+# index through binary search.
+MAGIC = b"RMSNAP01"
+SNAPSHOT_MODELS = (Character, Episode, Location)
+TYPECODES = {"int": "i", "bool": "B", "str": "I"}
+
+
+def column_kind(column):
+    if isinstance(column.type, Boolean):
+        return "bool"
+    if isinstance(column.type, Integer):
+        return "int"
+    return "str"
+
+
+def _pad(data):
+    return data + b"\0" * (-len(data) % 8)
+
+
+def write_snapshot(path):
+    strings = {}
+    blobs = []
+    sections = []
+    header = {"tables": {}}
+    offset = 0
+
+    def intern(value):
+        if value not in strings:
+            strings[value] = len(strings)
+            blobs.append(value.encode("utf-8"))
+        return strings[value]
+
+    for model in SNAPSHOT_MODELS:
+        fields = list(model.serialize_fields)
+        rows = db.session.query(*[getattr(model, x) for x in fields]).order_by(model.id).all()
+        columns = []
+        for position, name in enumerate(fields):
+            kind = column_kind(getattr(model, name))
+            values = [row[position] for row in rows]
+            if kind == "str":
+                values = [intern(x) for x in values]
+            elif kind == "bool":
+                values = [1 if x else 0 for x in values]
+            data = _pad(array(TYPECODES[kind], values).tobytes())
+            columns.append({"name": name, "type": kind, "offset": offset})
+            sections.append(data)
+            offset += len(data)
+        header["tables"][model.__tablename__] = {"rows": len(rows), "columns": columns}
+
+    string_offsets = array("I", [0])
+    for blob in blobs:
+        string_offsets.append(string_offsets[-1] + len(blob))
+    header["strings"] = {"count": len(blobs), "offsets": offset}
+    sections.append(_pad(string_offsets.tobytes()))
+    offset += len(sections[-1])
+    header["strings"]["blob"] = offset
+    sections.append(b"".join(blobs))
+
+    header_bytes = _pad(json.dumps(header).encode("utf-8"))
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as file:
+        file.write(MAGIC + struct.pack("<I", len(header_bytes)) + b"\0" * 4 + header_bytes)
+        for data in sections:
+            file.write(data)
+    # Workers that already mapped the old file keep reading it until restart
+    os.replace(temporary, path)
+    return {name: table["rows"] for name, table in header["tables"].items()}
+
+
+class SnapshotTable:
+    def __init__(self, snapshot, rows, columns, base):
+        self.snapshot = snapshot
+        self.rows = rows
+        self.columns = {}
+        for column in columns:
+            start = base + column["offset"]
+            size = array(TYPECODES[column["type"]]).itemsize * rows
+            self.columns[column["name"]] = (column["type"], snapshot.view[start:start + size].cast(TYPECODES[column["type"]]))
+        self.ids = self.columns["id"][1]
+
+    def value(self, name, row):
+        kind, values = self.columns[name]
+        if kind == "str":
+            return self.snapshot.string(values[row])
+        if kind == "bool":
+            return bool(values[row])
+        return values[row]
+
+    def serialize(self, row, fields):
+        return {x: self.value(x, row) for x in fields}
+
+    def get(self, object_id, fields):
+        row = bisect_right(self.ids, object_id) - 1
+        if row < 0 or self.ids[row] != object_id:
+            return None
+        return self.serialize(row, fields)
+
+    def page(self, after, limit, fields):
+        start = bisect_right(self.ids, after)
+        end = min(start + limit, self.rows)
+        body = [self.serialize(x, fields) for x in range(start, end)]
+        next_cursor = self.ids[end - 1] if end < self.rows and body else None
+        return body, next_cursor
+
+
+class CatalogSnapshot:
+    # Read-only view over a file written by write_snapshot(). The file is
+    # memory-mapped, so every worker that opens it shares the same pages
+    # through the OS page cache instead of holding its own copy.
+
+    def __init__(self):
+        self.tables = {}
+        self.path = None
+        # Shared version of each model when the file was loaded (versions.py)
+        self.versions = {}
+
+    def load(self, path):
+        self.versions = {model.__name__: shared_versions.stamp(model.__name__)
+                         for model in (Character, Episode, Location)}
+        with open(path, "rb") as file:
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mmap)
+        if bytes(self.view[:8]) != MAGIC:
+            raise ValueError(path + " is not a catalog snapshot")
+        header_length = struct.unpack_from("<I", self.mmap, 8)[0]
+        header = json.loads(bytes(self.view[16:16 + header_length]).rstrip(b"\0"))
+        base = 16 + header_length
+        strings = header["strings"]
+        self._string_offsets = self.view[base + strings["offsets"]:base + strings["offsets"] + 4 * (strings["count"] + 1)].cast("I")
+        self._blob = base + strings["blob"]
+        self.tables = {name: SnapshotTable(self, table["rows"], table["columns"], base)
+                       for name, table in header["tables"].items()}
+        self.path = path
+
+    def string(self, index):
+        start = self._blob + self._string_offsets[index]
+        end = self._blob + self._string_offsets[index + 1]
+        return str(self.view[start:end], "utf-8")
+
+    def table(self, model):
+        # Once the model was edited (admin, catalog import) the snapshot is
+        # stale for it and reads go back to the database until it is rebuilt
+        if self.versions.get(model.__name__) != shared_versions.stamp(model.__name__):
+            return None
+        return self.tables.get(model.__tablename__)
+
+
+catalog_snapshot = CatalogSnapshot()
+
+# Plain pages and id lookups are answered from the snapshot; filters, batches
+# and streams still go to the database.
+SNAPSHOT_ARGS = {"limit", "after", "fields"}
+
+
+def serve_from_snapshot(model, object_id=None):
+    table = catalog_snapshot.table(model)
+    if table is None or set(request.args) - SNAPSHOT_ARGS or wants_stream():
+        return None
+    fields = get_fields_arg(model)
+    if object_id is None:
+        limit, after = get_page_args()
+        body, next_cursor = table.page(after, limit, fields)
+        return json_response({"body": body, "next": next_cursor}), 200
+    result = table.get(object_id, fields)
+    if result is None:
+        return json_response({"msg": "The user you are looking for doesn't exist."}), 200
+    return json_response({"Result": result}), 200
+
+
+def setup_snapshot(app):
+    path = app.config.get('CATALOG_SNAPSHOT_PATH')
+    if path:
+        catalog_snapshot.load(path)
@@ -0,0 +1,109 @@
+import os
+import threading
+import time
+from functools import wraps
+from flask import g, has_request_context
+from sqlalchemy import event
+from models import db
+from replicas import replica_set
+
+# Applied to every new SQLite connection. WAL lets readers run while a write
+# is in progress; synchronous=NORMAL is durable across application crashes
+# and only risks the last transactions on power loss. A negative cache_size
+# is in KiB, busy_timeout in milliseconds.
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", -64 * 1024)),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT", 5000)),
+}
+
+
+class WriteStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.writes = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.hold_seconds = 0.0
+
+    def record(self, waited, held):
+        with self._lock:
+            self.writes += 1
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+            self.hold_seconds += held
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "writes": self.writes,
+                "wait_us_total": round(self.wait_seconds * 1e6),
+                "wait_us_max": round(self.max_wait_seconds * 1e6),
+                "hold_us_total": round(self.hold_seconds * 1e6),
+            }
+
+
+write_stats = WriteStats()
+_write_lock = threading.Lock()
+_enabled = False
+
+
+def serialized_write(view):
+    # Runs the handler under a process-wide lock and opens its transaction
+    # with BEGIN IMMEDIATE, so the SQLite write lock is taken up front: threads
+    # of one worker queue on the lock and other workers wait in busy_timeout,
+    # instead of failing with "database is locked" when a read transaction
+    # tries to upgrade to a write.
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return view(*args, **kwargs)
+        started = time.perf_counter()
+        with _write_lock:
+            acquired = time.perf_counter()
+            g.sqlite_immediate = True
+            try:
+                return view(*args, **kwargs)
+            except Exception:
+                db.session.rollback()
+                raise
+            finally:
+                g.sqlite_immediate = False
+                write_stats.record(acquired - started, time.perf_counter() - acquired)
+    return wrapper
+
+
+def _on_connect(dbapi_connection, connection_record):
+    # Let SQLAlchemy's begin event emit BEGIN instead of the driver
+    dbapi_connection.isolation_level = None
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute("PRAGMA %s=%s" % (name, value))
+    cursor.close()
+
+
+def _on_begin(connection):
+    immediate = has_request_context() and g.get("sqlite_immediate")
+    # Straight on the driver connection, like the implicit BEGIN other
+    # drivers send, so it does not count as a statement in the instrumentation
+    connection.connection.driver_connection.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+
+
+def get_write_stats():
+    return write_stats.to_dict() if _enabled else None
+
+
+def setup_sqlite(app):
+    # Call after setup_replicas: SQLite replica files get the same pragmas
+    global _enabled
+    if not app.config.get('SQLITE_PRODUCTION_MODE'):
+        return
+    with app.app_context():
+        engines = [db.engine] + [x.engine for x in replica_set.replicas]
+    for engine in engines:
+        if engine.dialect.name == "sqlite":
+            event.listen(engine, "connect", _on_connect)
+            event.listen(engine, "begin", _on_begin)
+    _enabled = app.config['SQLALCHEMY_DATABASE_URI'].startswith("sqlite")
@@ -1,4 +1,15 @@
-from flask import jsonify, url_for
+import hashlib
+from functools import wraps
+from flask import jsonify, url_for, request, make_response, Response, stream_with_context
+from models import db
+from serialization import dumps, row_serializer, msgpack, MSGPACK_MIMETYPES
+from compression import encode_body, is_compressible
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+MAX_BATCH_IDS = 100
+STREAM_BATCH_SIZE = 500
+NDJSON_MIMETYPE = "application/x-ndjson"
 
 class APIException(Exception):
     status_code = 400
@@ -15,6 +26,181 @@ class APIException(Exception):
         rv['message'] = self.message
         return rv
 
+def get_int_arg(name, default, args=None):
+    # `args` lets the async app (asgi.py) pass its own query parameters
+    value = (request.args if args is None else args).get(name)
+    if value is None or value == "":
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise APIException("'" + name + "' must be an integer", status_code=400)
+
+def get_fields_arg(model, args=None):
+    value = (request.args if args is None else args).get("fields")
+    if not value:
+        return list(model.serialize_fields)
+    fields = [x.strip() for x in value.split(",") if x.strip()]
+    unknown = [x for x in fields if x not in model.serialize_fields]
+    if unknown:
+        raise APIException("Unknown fields: " + ", ".join(unknown), status_code=400)
+    # id is always returned, pagination cursors are built from it
+    return ["id"] + [x for x in dict.fromkeys(fields) if x != "id"]
+
+def get_bool_arg(name):
+    value = request.args.get(name, "").lower()
+    if value in ("1", "true"):
+        return True
+    if value in ("0", "false"):
+        return False
+    raise APIException("'" + name + "' must be true or false", status_code=400)
+
+def escape_like(value):
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def apply_filters(query, model):
+    # Exact matches on the model's filter_fields, a prefix match (?name=) and a
+    # substring match (?name_contains=) on its search_field. Each one is
+    # backed by an index from migration d9a32c5f82d7.
+    for name in model.filter_fields:
+        if name not in request.args:
+            continue
+        column = getattr(model, name)
+        if isinstance(column.type, db.Boolean):
+            query = query.filter(column == get_bool_arg(name))
+        else:
+            query = query.filter(column == request.args[name])
+    search_column = getattr(model, model.search_field)
+    if request.args.get("name"):
+        query = query.filter(search_column.like(escape_like(request.args["name"]) + "%", escape="\\"))
+    if request.args.get("name_contains"):
+        query = query.filter(search_column.ilike("%" + escape_like(request.args["name_contains"]) + "%", escape="\\"))
+    return query
+
+def select_fields(model, sparse=True):
+    # Selects only the serialized columns (just the ?fields= ones when sparse)
+    # and builds each dict straight from the row tuple, without ORM entities.
+    fields = get_fields_arg(model) if sparse else list(model.serialize_fields)
+    query = db.session.query(*[getattr(model, x) for x in fields])
+    return query, row_serializer(fields)
+
+def get_page_args(args=None):
+    limit = get_int_arg("limit", DEFAULT_PAGE_SIZE, args)
+    after = get_int_arg("after", 0, args)
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise APIException("'limit' must be between 1 and " + str(MAX_PAGE_SIZE), status_code=400)
+    return limit, after
+
+def paginate(query, model):
+    # Keyset pagination on the primary key: every page is a bounded
+    # "id > after ORDER BY id LIMIT n" range scan, however deep the client pages.
+    limit, after = get_page_args()
+    rows = query.filter(model.id > after).order_by(model.id).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1].id
+    return rows, next_cursor
+
+def get_ids_arg():
+    ids = []
+    for value in request.args.get("ids", "").split(","):
+        value = value.strip()
+        if value == "":
+            continue
+        try:
+            ids.append(int(value))
+        except ValueError:
+            raise APIException("'ids' must be a comma separated list of integers", status_code=400)
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        raise APIException("'ids' can't be empty", status_code=400)
+    if len(ids) > MAX_BATCH_IDS:
+        raise APIException("At most " + str(MAX_BATCH_IDS) + " ids per request", status_code=400)
+    return ids
+
+def fetch_by_ids(query, model):
+    # One "id IN (...)" query for the whole batch, handed back in request order.
+    ids = get_ids_arg()
+    found = {row.id: row for row in query.filter(model.id.in_(ids)).all()}
+    rows = [found[x] for x in ids if x in found]
+    missing = [x for x in ids if x not in found]
+    return rows, missing
+
+def wants_stream():
+    if request.args.get("stream") in ("1", "true"):
+        return True
+    return request.accept_mimetypes.best == NDJSON_MIMETYPE
+
+def stream_ndjson(query, model, serialize):
+    # One JSON object per line, written as rows come off the cursor.
+    # yield_per keeps a server-side cursor open (stream_results) so memory
+    # stays at one batch no matter how big the table is.
+    def generate():
+        for row in query.order_by(model.id).yield_per(STREAM_BATCH_SIZE):
+            yield dumps(serialize(row)) + b"\n"
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+def content_etag(body):
+    return hashlib.sha1(body).hexdigest()
+
+def make_conditional(response, etag=None, variants=None):
+    # Strong ETag over the exact response bytes, compressed when the client
+    # accepts it; a matching If-None-Match turns the response into an empty
+    # 304 Not Modified.
+    if response.status_code != 200 or response.is_streamed:
+        return response
+    body = response.get_data()
+    etag = etag or content_etag(body)
+    if is_compressible(body):
+        response.vary.add("Accept-Encoding")
+        body, etag, encoding = encode_body(body, etag, request.headers.get("Accept-Encoding"), variants)
+        if encoding is not None:
+            response.set_data(body)
+            response.headers["Content-Encoding"] = encoding
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+def conditional_response(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        return make_conditional(make_response(view(*args, **kwargs)))
+    return wrapper
+
+def upsert_statement(table, index_elements, update=None):
+    # INSERT ... ON CONFLICT on Postgres/SQLite and ON DUPLICATE KEY / INSERT
+    # IGNORE on MySQL. `update(table, new)` maps columns to expressions over the
+    # conflicting new row; without it conflicting rows are left untouched.
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+        statement = insert(table)
+        if update is None:
+            return statement.prefix_with("IGNORE")
+        return statement.on_duplicate_key_update(update(table, statement.inserted))
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    statement = insert(table)
+    if update is None:
+        return statement.on_conflict_do_nothing(index_elements=index_elements)
+    return statement.on_conflict_do_update(index_elements=index_elements, set_=update(table, statement.excluded))
+
+def request_body():
+    # JSON by default; MessagePack when sent with Content-Type: application/msgpack
+    if request.mimetype not in MSGPACK_MIMETYPES:
+        return request.json
+    if msgpack is None:
+        raise APIException("MessagePack request bodies are not supported", status_code=415)
+    try:
+        body = msgpack.unpackb(request.get_data())
+    except (ValueError, msgpack.UnpackException):
+        raise APIException("Invalid MessagePack body", status_code=400)
+    if not isinstance(body, dict):
+        raise APIException("The request body must be a map", status_code=400)
+    return body
+
 def has_no_empty_params(rule):
     defaults = rule.defaults if rule.defaults is not None else ()
     arguments = rule.arguments if rule.arguments is not None else ()
@@ -0,0 +1,62 @@
+import hashlib
+import os
+import tempfile
+import time
+import uuid
+
+# Each worker keeps its own response cache and search index. A write bumps the
+# version of the tables it changed in a directory shared by every process on
+# the host, and the other workers compare the stamp before trusting what they
+# hold. Workers on different hosts do not share it: there the cache TTL is the
+# bound on staleness.
+
+
+class SharedVersions:
+    def __init__(self):
+        self.directory = None
+        # tag -> stamp of this process's latest bump
+        self.written = {}
+
+    def _path(self, tag):
+        return os.path.join(self.directory, tag)
+
+    def stamp(self, tag):
+        # Changes on every bump(): os.replace gives the file a new inode
+        if self.directory is None:
+            return None
+        try:
+            stat = os.stat(self._path(tag))
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def age(self, tag):
+        # Seconds since the last bump of `tag`, None if it never was
+        stamp = self.stamp(tag)
+        if stamp is None:
+            return None
+        return (time.time_ns() - stamp[1]) / 1e9
+
+    def bump(self, tag):
+        if self.directory is None:
+            return
+        fd, path = tempfile.mkstemp(dir=self.directory, prefix="." + tag)
+        with os.fdopen(fd, "w") as file:
+            file.write(uuid.uuid4().hex)
+        os.replace(path, self._path(tag))
+        self.written[tag] = self.stamp(tag)
+
+
+shared_versions = SharedVersions()
+
+
+def default_directory(database_uri):
+    # One directory per database, so two apps on the same host never mix
+    digest = hashlib.sha1(database_uri.encode()).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), "catalog-versions-" + digest)
+
+
+def setup_versions(app):
+    directory = app.config.get('CATALOG_VERSION_DIR') or default_directory(app.config['SQLALCHEMY_DATABASE_URI'])
+    os.makedirs(directory, exist_ok=True)
+    shared_versions.directory = directory
@@ -0,0 +1,71 @@
+import os
+import sys
+import tempfile
+import pytest
+from sqlalchemy import event
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+# The app reads its config at import time. Always overwrite: pipenv loads .env,
+# which points at the developer's own database.
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db")
+os.environ["RESPONSE_CACHE_MAX_ENTRIES"] = "0"
+os.environ["DATABASE_REPLICA_URLS"] = ""
+os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+os.environ.pop("CATALOG_SNAPSHOT_PATH", None)
+
+
+class QueryCounter:
+    # Counts the statements sent to the engine while installed
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+    def reset(self):
+        self.count = 0
+
+
+@pytest.fixture(scope="session")
+def app():
+    from app import app
+    return app
+
+
+@pytest.fixture(autouse=True)
+def database(app):
+    from models import db, User, Character, Episode, Location, character_favs, location_favs, episode_favs
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.add_all([User(id=i, username="user%d" % i, first_name="First", last_name="Last",
+                                 email="user%d@example.com" % i, password="secret") for i in (1, 2)])
+        db.session.add_all([Character(id=i, character_name="Character %d" % i, gender="Female",
+                                      alive=True, species="Human") for i in (1, 2, 3)])
+        db.session.add_all([Episode(id=i, episode_name="Episode %d" % i, air_date="2013-12-02",
+                                    episode="S01E%02d" % i) for i in (1, 2, 3)])
+        db.session.add_all([Location(id=i, location_name="Location %d" % i, location_type="Planet",
+                                     dimension="C-137") for i in (1, 2, 3)])
+        db.session.flush()
+        db.session.execute(character_favs.insert(), [{"user_id": 1, "character_id": x} for x in (1, 2)])
+        db.session.execute(location_favs.insert(), [{"user_id": 1, "location_id": 1}])
+        db.session.execute(episode_favs.insert(), [{"user_id": 1, "episode_id": x} for x in (1, 3)])
+        db.session.commit()
+    yield db
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def queries(app, database):
+    counter = QueryCounter()
+    with app.app_context():
+        engine = database.engine
+    event.listen(engine, "before_cursor_execute", counter)
+    yield counter
+    event.remove(engine, "before_cursor_execute", counter)
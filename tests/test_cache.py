@@ -0,0 +1,37 @@
+import pytest
+
+
+@pytest.fixture
+def response_cache(monkeypatch):
+    from cache import response_cache
+    monkeypatch.setattr(response_cache, "max_entries", 512)
+    response_cache.invalidate()
+    yield response_cache
+    response_cache.invalidate()
+
+
+def rename_in_other_worker(app, database, name):
+    # A Core update fires no ORM events, like a commit made by another process
+    from models import Character
+    with app.app_context():
+        database.session.execute(Character.__table__.update().where(Character.id == 1).values(character_name=name))
+        database.session.commit()
+
+
+def test_other_worker_bump_drops_cached_entry(app, client, database, response_cache):
+    from versions import shared_versions
+    assert client.get("/characters/1").json["Result"]["character_name"] == "Character 1"
+    rename_in_other_worker(app, database, "Renamed")
+    assert client.get("/characters/1").json["Result"]["character_name"] == "Character 1"
+    shared_versions.bump("Character")
+    assert client.get("/characters/1").json["Result"]["character_name"] == "Renamed"
+
+
+def test_commit_bumps_shared_version(app, database, response_cache):
+    from models import Character
+    from versions import shared_versions
+    before = shared_versions.stamp("Character")
+    with app.app_context():
+        database.session.get(Character, 1).character_name = "Renamed"
+        database.session.commit()
+    assert shared_versions.stamp("Character") != before
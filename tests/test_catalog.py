@@ -0,0 +1,62 @@
+import io
+import json
+import pytest
+from sqlalchemy import event, select, text
+from sqlalchemy.exc import IntegrityError
+
+
+def test_links_before_their_catalog_rows(app, database):
+    from catalog import import_catalog
+    from models import Character, Episode, episodes__characters
+    lines = [
+        {"type": "episode_character", "episode_id": 20, "character_id": 20},
+        {"type": "character", "id": 20, "character_name": "Squanchy", "gender": "Male", "alive": True, "species": "Cat-Person"},
+        {"type": "episode", "id": 20, "episode_name": "The Wedding Squanchers", "air_date": "2015-10-04", "episode": "S02E10"},
+    ]
+    file = io.StringIO("\n".join(json.dumps(x) for x in lines))
+    inserts = []
+
+    def record(conn, cursor, statement, *args):
+        if statement.startswith("INSERT INTO"):
+            inserts.append(statement.split()[2])
+
+    with app.app_context():
+        event.listen(database.engine, "before_cursor_execute", record)
+        try:
+            counts = import_catalog(file, "ndjson", batch_size=1)
+        finally:
+            event.remove(database.engine, "before_cursor_execute", record)
+        # Postgres checks non-deferrable foreign keys on every statement
+        assert inserts == ["character", "episode", "episodes__characters"]
+        assert counts["episode_character"] == 1
+        assert database.session.get(Character, 20).character_name == "Squanchy"
+        assert database.session.get(Episode, 20).episode == "S02E10"
+        assert database.session.execute(select(episodes__characters.c.character_id)
+                                        .where(episodes__characters.c.episode_id == 20)).scalars().all() == [20]
+
+
+def test_link_to_missing_row_fails(app, database):
+    from catalog import import_catalog
+    file = io.StringIO(json.dumps({"type": "episode_character", "episode_id": 1, "character_id": 99}))
+    with app.app_context():
+        database.session.execute(text("PRAGMA foreign_keys = ON"))
+        with pytest.raises(IntegrityError):
+            import_catalog(file, "ndjson")
+
+
+def test_records_leaving_out_a_defaulted_column(app, database):
+    from catalog import import_catalog
+    from models import Character
+    first = [
+        {"type": "character", "id": 30, "character_name": "Birdperson", "gender": "Male", "alive": False, "species": "Bird-Person"},
+        {"type": "character", "id": 31, "character_name": "Tammy", "gender": "Female", "species": "Human"},
+    ]
+    # Re-import without "alive": the stored value must stay as it is
+    second = [{"type": "character", "id": 30, "character_name": "Phoenixperson", "gender": "Male", "species": "Cyborg"}]
+    with app.app_context():
+        for lines in (first, second):
+            import_catalog(io.StringIO("\n".join(json.dumps(x) for x in lines)), "ndjson")
+        database.session.expire_all()
+        birdperson = database.session.get(Character, 30)
+        assert (birdperson.character_name, birdperson.alive) == ("Phoenixperson", False)
+        assert database.session.get(Character, 31).alive is True
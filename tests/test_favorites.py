@@ -0,0 +1,64 @@
+import pytest
+from sqlalchemy import select
+
+
+@pytest.mark.parametrize("body", [[1], {"add": [1]}, {"remove": "characters"}, {"add": 0}, {"add": {"characters": ["1"]}},
+                                  {"add": {"character": [1]}}, {"add": {"characters": 0}}, {"remove": {"episodes": ""}},
+                                  {"add": {"locations": None}}])
+def test_bulk_update_rejects_malformed_bodies(client, body):
+    response = client.patch("/user/1/favorites", json=body)
+    assert response.status_code == 400
+    assert "message" in response.json
+
+
+def test_bulk_update_missing_user(client):
+    response = client.patch("/user/99/favorites", json={"add": {"characters": [1]}})
+    assert response.status_code == 404
+
+
+def favorite_count(app, database, kind, object_id):
+    from models import favorite_counts
+    with app.app_context():
+        return database.session.execute(select(favorite_counts.c.count).where(
+            favorite_counts.c.kind == kind, favorite_counts.c.object_id == object_id)).scalar()
+
+
+def test_repeated_add_counts_once(app, client, database):
+    for _ in range(2):
+        assert client.post("/user/2/favorites/characters/3").status_code == 200
+    assert favorite_count(app, database, "character", 3) == 1
+    assert [x["id"] for x in client.get("/user/2/favorites/character").json["charactersFav"]] == [3]
+
+
+def test_removing_absent_favorite(app, client, database):
+    client.post("/user/2/favorites/episodes/2")
+    for _ in range(2):
+        assert client.delete("/user/2/favorites/episodes/2").status_code == 200
+    assert favorite_count(app, database, "episode", 2) == 0
+
+
+@pytest.mark.parametrize("method", ["POST", "DELETE"])
+@pytest.mark.parametrize("path", ["/user/99/favorites/locations/1", "/user/1/favorites/locations/99"])
+def test_missing_user_or_target(client, method, path):
+    assert client.open(path, method=method).status_code == 404
+
+
+@pytest.mark.parametrize("body", [{"character_id": 2}, [1], "1"])
+def test_body_must_match_url(client, body):
+    assert client.post("/user/2/favorites/characters/1", json=body).status_code == 400
+
+
+def test_body_repeating_url_id(client):
+    assert client.post("/user/2/favorites/characters/1", json={"character_id": 1}).status_code == 200
+
+
+def test_bulk_insert_skips_rows_added_concurrently(app, database):
+    # User 1 already has character 1, as if another request added it after
+    # the PATCH read the user's favorites
+    from app import write_favorites
+    from models import character_favs
+    with app.app_context():
+        added = write_favorites(1, character_favs, character_favs.c.character_id, {1, 3}, insert=True)
+        removed = write_favorites(1, character_favs, character_favs.c.character_id, {2, 3, 4}, insert=False)
+        database.session.commit()
+    assert (added, removed) == ([3], [2, 3])
@@ -0,0 +1,46 @@
+import pytest
+from sqlalchemy import select
+
+
+@pytest.fixture
+def strict(app, monkeypatch):
+    monkeypatch.setitem(app.config, "QUERY_BUDGET_STRICT", True)
+
+
+@pytest.mark.parametrize("method, path, body", [
+    ("GET", "/users", None),
+    ("GET", "/characters", None),
+    ("GET", "/characters/1", None),
+    ("GET", "/episodes/1/characters", None),
+    ("GET", "/characters/top", None),
+    ("GET", "/user/1/favorites", None),
+    ("GET", "/user/1/favorites/episode", None),
+    ("POST", "/user/2/favorites/characters/1", None),
+    ("DELETE", "/user/1/favorites/characters/1", None),
+    ("POST", "/user_register", {"username": "new", "first_name": "N", "last_name": "N",
+                                "email": "new@example.com", "password": "x"}),
+])
+def test_endpoints_within_budget(client, strict, method, path, body):
+    response = client.open(path, method=method, json=body)
+    assert response.status_code == 200
+
+
+def test_full_bulk_update_within_budget(client, strict, queries):
+    # Every kind both adds and removes: the most statements the PATCH can run
+    response = client.patch("/user/1/favorites", json={
+        "add": {"characters": [3], "locations": [2], "episodes": [2]},
+        "remove": {"characters": [1], "locations": [1], "episodes": [1]},
+    })
+    assert response.status_code == 200
+    assert response.json["added"] == {"characters": [3], "locations": [2], "episodes": [2]}
+    assert queries.count == 19
+
+
+def test_over_budget_write_is_rolled_back(app, client, strict, monkeypatch, database):
+    from models import character_favs
+    monkeypatch.setattr(app.view_functions["add_character_favorite"], "query_budget", 1)
+    response = client.post("/user/2/favorites/characters/1")
+    assert response.status_code == 500
+    with app.app_context():
+        rows = database.session.execute(select(character_favs).where(character_favs.c.user_id == 2)).all()
+    assert rows == []
@@ -0,0 +1,23 @@
+import pytest
+
+
+def test_all_user_favorites(client, queries):
+    response = client.get("/user/1/favorites")
+    assert response.status_code == 200
+    assert [x["id"] for x in response.json["charactersFav"]] == [1, 2]
+    assert [x["id"] for x in response.json["episodesFav"]] == [1, 3]
+    assert queries.count == 4
+
+
+@pytest.mark.parametrize("kind", ["character", "location", "episode"])
+def test_single_kind_favorites(client, queries, kind):
+    response = client.get("/user/1/favorites/" + kind)
+    assert response.status_code == 200
+    assert response.json[kind + "sFav"]
+    assert queries.count == 2
+
+
+def test_favorites_of_missing_user(client, queries):
+    response = client.get("/user/99/favorites")
+    assert response.status_code == 404
+    assert queries.count == 1
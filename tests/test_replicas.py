@@ -0,0 +1,32 @@
+import pytest
+
+
+@pytest.fixture
+def broken_replica(app, database, monkeypatch, tmp_path):
+    # A replica without any tables: every read on it fails with OperationalError
+    from replicas import Replica, replica_set, _dispatch_with_fallback, _eject_on_error
+    from sqlalchemy import event
+    replica = Replica("sqlite:///" + str(tmp_path / "replica.db"), {})
+    event.listen(replica.engine, "handle_error", _eject_on_error)
+    monkeypatch.setattr(replica_set, "replicas", [replica])
+    monkeypatch.setattr(app, "dispatch_request", _dispatch_with_fallback(app.dispatch_request, database.session))
+    return replica
+
+
+def test_failed_replica_read_is_retried_on_primary(client, broken_replica):
+    response = client.get("/user/1/favorites")
+    assert response.status_code == 200
+    assert [x["id"] for x in response.json["charactersFav"]] == [1, 2]
+    assert not broken_replica.is_healthy()
+
+
+def test_cache_refill_after_a_change_reads_primary(app, client, database, broken_replica, monkeypatch):
+    from cache import response_cache
+    from models import Character
+    monkeypatch.setattr(response_cache, "max_entries", 512)
+    with app.app_context():
+        database.session.get(Character, 1).character_name = "Renamed"
+        database.session.commit()
+    assert client.get("/characters/1").json["Result"]["character_name"] == "Renamed"
+    assert broken_replica.is_healthy()
+    response_cache.invalidate()
@@ -0,0 +1,58 @@
+import pytest
+
+
+@pytest.fixture
+def catalog(app, database):
+    from models import Character
+    from search import search_index
+    with app.app_context():
+        database.session.add_all([
+            Character(id=10, character_name="Rick Sanchez", gender="Male", alive=True, species="Human"),
+            Character(id=11, character_name="Morty Smith", gender="Male", alive=True, species="Human"),
+        ])
+        database.session.commit()
+    search_index.built = False
+
+
+def search(client, query):
+    response = client.get("/search", query_string={"q": query, "type": "character"})
+    assert response.status_code == 200
+    return [x["id"] for x in response.json["body"]]
+
+
+@pytest.mark.parametrize("query", ["r", "ri", "ric", "rik", "rick", "rick sanchez", "sanhcez"])
+def test_prefixes_and_typos(client, catalog, query):
+    assert search(client, query)[0] == 10
+
+
+@pytest.mark.parametrize("query", ["mroty", "morty smiht", "m"])
+def test_transposed_letters(client, catalog, query):
+    assert search(client, query)[0] == 11
+
+
+def test_unrelated_query(client, catalog):
+    assert search(client, "zzz") == []
+
+
+def test_commit_in_this_worker_updates_index(app, client, catalog, database):
+    from models import Character
+    assert search(client, "summer") == []
+    with app.app_context():
+        database.session.add(Character(id=12, character_name="Summer Smith", gender="Female", alive=True, species="Human"))
+        database.session.commit()
+    assert search(client, "summer") == [12]
+
+
+def test_commit_in_other_worker_rebuilds_index(app, client, catalog, database):
+    from models import Character
+    from versions import shared_versions
+    assert search(client, "beth") == []
+    with app.app_context():
+        # Core insert: no mapper events, like a commit made by another process
+        database.session.execute(Character.__table__.insert().values(
+            id=13, character_name="Beth Smith", gender="Female", alive=True, species="Human"))
+        database.session.commit()
+    assert search(client, "beth") == []
+    shared_versions.bump("Character")
+    shared_versions.written.pop("Character")  # as if another process bumped it
+    assert search(client, "beth") == [13]
@@ -0,0 +1,29 @@
+import pytest
+import serialization
+
+pytestmark = pytest.mark.skipif("orjson" not in serialization.BACKENDS, reason="orjson is not installed")
+
+
+@pytest.mark.parametrize("value", [0.0, 0.5, 0.667, 1 / 3, 0.0001, 123.456, 2.5e15, -7.25, 1e15 + 0.5])
+def test_backends_agree_on_floats(value):
+    payload = {"score": value, "nested": [value, {"ms": value}]}
+    assert serialization.BACKENDS["stdlib"](payload) == serialization.BACKENDS["orjson"](payload)
+
+
+@pytest.mark.parametrize("value", [1e-05, 1e16])
+def test_floats_outside_the_range_differ(value):
+    # Documented in serialization.py; payloads must keep clear of these
+    assert serialization.BACKENDS["stdlib"](value) != serialization.BACKENDS["orjson"](value)
+
+
+def test_pool_stats_have_no_floats(client):
+    def floats(value):
+        if isinstance(value, dict):
+            return [x for v in value.values() for x in floats(v)]
+        if isinstance(value, list):
+            return [x for v in value for x in floats(v)]
+        return [value] if isinstance(value, float) else []
+
+    response = client.get("/stats/pool")
+    assert response.status_code == 200
+    assert floats(response.json) == []
@@ -0,0 +1,32 @@
+import pytest
+
+
+@pytest.fixture
+def snapshot(app, database, tmp_path):
+    from snapshot import catalog_snapshot, write_snapshot
+    path = str(tmp_path / "catalog.snapshot")
+    with app.app_context():
+        write_snapshot(path)
+    catalog_snapshot.load(path)
+    yield catalog_snapshot
+    catalog_snapshot.tables = {}
+    catalog_snapshot.versions = {}
+
+
+def test_serves_from_snapshot_until_model_changes(app, client, database, snapshot, queries):
+    from models import Character
+    queries.reset()
+    assert client.get("/characters/1").json["Result"]["character_name"] == "Character 1"
+    assert queries.count == 0
+
+    # An ORM commit (admin, API) bumps the shared version of the model
+    with app.app_context():
+        database.session.get(Character, 1).character_name = "Renamed"
+        database.session.commit()
+    assert client.get("/characters/1").json["Result"]["character_name"] == "Renamed"
+    assert client.get("/characters").json["body"][0]["character_name"] == "Renamed"
+
+    # Models that did not change are still served from the file
+    queries.reset()
+    assert client.get("/episodes/1").json["Result"]["episode_name"] == "Episode 1"
+    assert queries.count == 0